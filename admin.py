@@ -0,0 +1,117 @@
+import asyncio
+import base64
+import os  # get environment variables
+import secrets
+from urllib.parse import urlencode
+from fasthtml.common import *
+from form_schema import TITLES, DEPARTMENTS, RESEARCH_TYPES
+from export import FORMATS, available, export
+
+# Admin pages are behind HTTP basic auth, and disabled entirely when no password is set
+ADMIN_USER = os.environ.get("ADMIN_USER", "admin")
+ADMIN_PASSWORD = os.environ.get("ADMIN_PASSWORD")
+
+PAGE_SIZE = 50
+COLUMNS = ("id", "created_at", "full_name", "title", "dept", "research_type", "email", "post_forum", "description")
+FILTER_PARAMS = ("dept", "research_type", "title", "post_forum", "q", "since", "until")
+
+
+# Returns a 401/404 response when the request isn't from an admin, None otherwise
+def check_admin(req):
+    if not ADMIN_PASSWORD:
+        return Response("404 Not Found", status_code=404)
+    auth = req.headers.get("authorization", "")
+    if auth.startswith("Basic "):
+        try:
+            user, _, password = base64.b64decode(auth[6:]).decode().partition(":")
+        except (ValueError, UnicodeDecodeError):
+            user, password = "", ""
+        if secrets.compare_digest(user, ADMIN_USER) and secrets.compare_digest(password, ADMIN_PASSWORD):
+            return None
+    return Response("Unauthorized", status_code=401, headers={"WWW-Authenticate": 'Basic realm="admin"'})
+
+
+def filters_from(req):
+    return {k: req.query_params.get(k, "") for k in FILTER_PARAMS}
+
+
+def filter_select(name, label, options, current):
+    return Label(label, Select(name=name)(
+        Option(value="", selected=not current)("Any"),
+        *[Option(value=value, selected=value == current)(text) for value, text in options]
+    ))
+
+
+# Table rows for one page, plus a "Load more" row that swaps itself for the next page
+def submission_rows(local_store, filters, before_id=None):
+    rows, next_before = local_store.search(
+        {k: filters[k] for k in ("dept", "research_type", "title", "post_forum")},
+        q=filters["q"], since=filters["since"], until=filters["until"],
+        before_id=before_id, limit=PAGE_SIZE)
+    trs = [Tr(*[Td("Yes" if r[c] is True else "No" if r[c] is False else r[c]) for c in COLUMNS]) for r in rows]
+    if not rows and not before_id:
+        trs.append(Tr(Td(colspan=len(COLUMNS))("No submissions match these filters.")))
+    if next_before:
+        qs = urlencode({**{k: v for k, v in filters.items() if v}, "before": next_before})
+        trs.append(Tr(Td(colspan=len(COLUMNS))(
+            Button(hx_get=f"/admin/submissions/rows?{qs}", hx_target="closest tr", hx_swap="outerHTML")("Load more")
+        )))
+    return tuple(trs)
+
+
+def add_admin_routes(app, local_store):
+    # Full page: filters and the first page of results
+    @app.get("/admin/submissions")
+    async def admin_submissions(req):
+        if denied := check_admin(req):
+            return denied
+        filters = filters_from(req)
+        rows = await asyncio.to_thread(submission_rows, local_store, filters)
+        return Titled("Submissions",
+            # Changing any filter re-renders only the table body
+            Form(hx_get="/admin/submissions/rows", hx_target="#rows", hx_swap="innerHTML",
+                 hx_trigger="change, input delay:300ms from:input[name=q]", hx_push_url="false")(
+                Grid(
+                    filter_select("dept", "Department", zip(DEPARTMENTS, DEPARTMENTS), filters["dept"]),
+                    filter_select("research_type", "Research Type", zip(RESEARCH_TYPES, RESEARCH_TYPES), filters["research_type"]),
+                    filter_select("title", "Title", zip(TITLES, TITLES), filters["title"]),
+                    filter_select("post_forum", "Post Forum", (("1", "Yes"), ("0", "No")), filters["post_forum"]),
+                ),
+                Grid(
+                    Label("Search description", Input(type="search", name="q", value=filters["q"], placeholder="Search descriptions")),
+                    Label("Submitted from", Input(type="date", name="since", value=filters["since"])),
+                    Label("Submitted before", Input(type="date", name="until", value=filters["until"])),
+                ),
+            ),
+            P("Export: ", *[A(href=f"/admin/export/{fmt}", style="margin-right: 1em;")(fmt.upper()) for fmt in FORMATS]),
+            Table(
+                Thead(Tr(*[Th(c.replace("_", " ").title()) for c in COLUMNS])),
+                Tbody(id="rows")(*rows)
+            )
+        )
+
+    # Partial: table rows only, used by the filters and "Load more"
+    @app.get("/admin/submissions/rows")
+    async def admin_submission_rows(req):
+        if denied := check_admin(req):
+            return denied
+        before = req.query_params.get("before")
+        before_id = int(before) if before and before.isdigit() else None
+        return await asyncio.to_thread(submission_rows, local_store, filters_from(req), before_id)
+
+    # Streaming export, optionally incremental from a local id or created_at watermark
+    @app.get("/admin/export/{fmt}")
+    async def admin_export(req, fmt: str):
+        if denied := check_admin(req):
+            return denied
+        if fmt not in FORMATS:
+            return Response("404 Not Found", status_code=404)
+        if not available(fmt):
+            return Response(f"{fmt} export is not available on this server", status_code=501)
+        since_id = req.query_params.get("since_id", "")
+        media_type, ext = FORMATS[fmt]
+        return StreamingResponse(
+            export(local_store, fmt, since_id=int(since_id) if since_id.isdigit() else 0, since=req.query_params.get("since", "")),
+            media_type=media_type,
+            headers={"Content-Disposition": f'attachment; filename="researchform.{ext}"'}
+        )
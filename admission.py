@@ -0,0 +1,177 @@
+import asyncio
+import math
+import os  # get environment variables
+import time
+from starlette.responses import HTMLResponse, PlainTextResponse
+import metrics
+from shared_state import shared_state
+
+# Admission control for /submit: token buckets per client IP and per email address, plus a
+# cap on submissions in flight. Anything over the limits gets a fast 429 before doing real work.
+# The IP limit is generous on purpose: a whole hospital network can share one egress address.
+# It only catches floods; the per-email limit is the one a single person runs into.
+RATE_IP_PER_MINUTE = float(os.environ.get("RATE_IP_PER_MINUTE", "120"))
+RATE_IP_BURST = float(os.environ.get("RATE_IP_BURST", "60"))
+RATE_EMAIL_PER_HOUR = float(os.environ.get("RATE_EMAIL_PER_HOUR", "10"))
+RATE_EMAIL_BURST = float(os.environ.get("RATE_EMAIL_BURST", "3"))
+MAX_IN_FLIGHT = int(os.environ.get("MAX_IN_FLIGHT", "50"))
+# Behind reverse proxies every request comes from the last proxy's address: set TRUST_PROXY to the
+# number of proxies in front of the app (1 for a single nginx or load balancer) and the client is
+# taken from X-Forwarded-For, that many entries from the right. Each proxy appends the address it
+# received the request from, so anything further left was written by the client and can be forged.
+# Leave it at 0 when clients connect directly.
+TRUST_PROXY = int(os.environ.get("TRUST_PROXY", "0"))
+
+
+class TokenBuckets:
+    def __init__(self, rate, capacity, max_keys=100_000, sweep_every=1024):
+        self.rate = rate  # tokens added per second
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self.sweep_every = sweep_every
+        self.buckets = {}  # key -> (tokens, updated_at)
+        self._ops = 0
+
+    # Take a token for key; returns 0 when allowed, otherwise seconds until the next token
+    def take(self, key, now=None):
+        now = time.monotonic() if now is None else now
+        tokens, updated = self.buckets.get(key, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+        self._ops += 1
+        if self._ops >= self.sweep_every or len(self.buckets) >= self.max_keys:
+            self.sweep(now)
+        if tokens >= 1:
+            self.buckets[key] = (tokens - 1, now)
+            return 0.0
+        self.buckets[key] = (tokens, now)
+        return (1 - tokens) / self.rate
+
+    # Async entry points used by the app; in memory there is nothing to wait for
+    async def acquire(self, key):
+        return self.take(key)
+
+    async def release(self, key):
+        self.refund(key)
+
+    # Give back a token taken for a request that turned out not to count (invalid or a repeat)
+    def refund(self, key):
+        if key in self.buckets:
+            tokens, updated = self.buckets[key]
+            self.buckets[key] = (min(self.capacity, tokens + 1), updated)
+
+    def sweep(self, now=None):
+        # A bucket that has refilled completely holds no information, drop it
+        now = time.monotonic() if now is None else now
+        self._ops = 0
+        full = [k for k, (tokens, updated) in self.buckets.items() if tokens + (now - updated) * self.rate >= self.capacity]
+        for k in full:
+            del self.buckets[k]
+        # Still too many (a flood of distinct keys): forget the oldest ones
+        excess = len(self.buckets) - self.max_keys
+        if excess > 0:
+            for k in list(self.buckets)[:excess + self.max_keys // 10]:
+                del self.buckets[k]
+
+
+# Multi-worker variant: the buckets live in the shared SQLite state so every worker draws from the same ones
+class SharedTokenBuckets(TokenBuckets):
+    def __init__(self, name, rate, capacity, shared, sweep_every=1024):
+        super().__init__(rate, capacity, sweep_every=sweep_every)
+        self.name = name
+        self.shared = shared
+
+    def take(self, key, now=None):
+        now = time.time() if now is None else now
+        self._ops += 1
+        if self._ops >= self.sweep_every:
+            self.sweep(now)
+        return self.shared.take_token(self.name, key, self.rate, self.capacity, now)
+
+    def refund(self, key):
+        self.shared.refund_token(self.name, key, self.capacity)
+
+    # Each take is a write transaction that may wait on another worker's lock, so never on the event loop
+    async def acquire(self, key):
+        return await asyncio.to_thread(self.take, key)
+
+    async def release(self, key):
+        await asyncio.to_thread(self.refund, key)
+
+    def sweep(self, now=None):
+        self._ops = 0
+        self.shared.sweep_tokens(self.name, self.rate, self.capacity, time.time() if now is None else now)
+
+
+if shared_state is not None:
+    ip_limits = SharedTokenBuckets("ip", RATE_IP_PER_MINUTE / 60, RATE_IP_BURST, shared_state)
+    email_limits = SharedTokenBuckets("email", RATE_EMAIL_PER_HOUR / 3600, RATE_EMAIL_BURST, shared_state)
+else:
+    ip_limits = TokenBuckets(RATE_IP_PER_MINUTE / 60, RATE_IP_BURST)
+    email_limits = TokenBuckets(RATE_EMAIL_PER_HOUR / 3600, RATE_EMAIL_BURST)
+
+
+STATUS_MESSAGE = "Too many submissions, please try again later."
+
+
+def too_many(retry_after, reason, htmx=False):
+    metrics.rejected.inc(reason)
+    headers = {"Retry-After": str(max(1, math.ceil(retry_after)))}
+    if htmx:
+        # htmx 2 doesn't swap 4xx responses, so the HTMX form gets a 200 that puts the message in #form-status
+        headers["HX-Reswap"] = "none"
+        return HTMLResponse(f'<div id="form-status" hx-swap-oob="true"><p style="color: red;">{STATUS_MESSAGE}</p></div>', headers=headers)
+    return PlainTextResponse(STATUS_MESSAGE, status_code=429, headers=headers)
+
+
+def client_ip(scope, trusted_hops=TRUST_PROXY):
+    if trusted_hops:
+        # Repeated headers count as one list, in order
+        forwarded = [ip.strip() for name, value in scope.get("headers", ()) if name == b"x-forwarded-for"
+                     for ip in value.decode("latin-1").split(",") if ip.strip()]
+        if forwarded:
+            return forwarded[-min(trusted_hops, len(forwarded))]
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def is_htmx(scope):
+    return any(name == b"hx-request" for name, _ in scope.get("headers", ()))
+
+
+# Raised from inside the submission handler, so the rejection is not remembered as the submission's result
+class RateLimited(Exception):
+    def __init__(self, retry_after, reason):
+        super().__init__(reason)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+# Per-email check, done in the handler only for a submission that is not a repeat of a recent one
+async def check_email(email):
+    retry_after = await email_limits.acquire(email.strip().lower())
+    if retry_after:
+        raise RateLimited(retry_after, "email")
+
+
+# ASGI middleware guarding POST requests to one path before the body is even read.
+# The in-flight cap is per worker process, it protects that process's event loop.
+class AdmissionMiddleware:
+    def __init__(self, app, path="/submit", max_in_flight=MAX_IN_FLIGHT):
+        self.app = app
+        self.path = path
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] != self.path:
+            return await self.app(scope, receive, send)
+        if self.in_flight >= self.max_in_flight:
+            return await too_many(1, "overload", is_htmx(scope))(scope, receive, send)
+        retry_after = await ip_limits.acquire(client_ip(scope))
+        if retry_after:
+            return await too_many(retry_after, "ip", is_htmx(scope))(scope, receive, send)
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
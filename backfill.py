@@ -0,0 +1,250 @@
+import argparse
+import asyncio
+import csv
+import hashlib
+import json
+import os  # get environment variables
+import sqlite3
+import sys
+import time
+from datetime import datetime, timezone
+from form_schema import FIELDS, validate
+from local_store import LocalStore, COLUMNS, BACKFILL_KEY_PREFIX
+
+# Backfill of historical submissions: the legacy submissions.db from main_old.py or CSV files,
+# validated with the /submit rules and upserted in multi-row batches.
+#   python backfill.py --legacy-db submissions.db --checkpoint backfill.json
+#   python backfill.py --csv old.csv --target local --db researchform_local.db
+# Rows keep a key derived from their content, so re-running (or resuming) never creates duplicates.
+# With --target local the rows get new local ids but keep their original created_at: id-based
+# incremental exports (export.py --since-id/--state) pick them up, created_at-based ones (--since)
+# don't. The committee digest skips them, they are not new submissions.
+
+LEGACY_DATE_FORMAT = "%m/%d/%Y, %H:%M:%S"  # how main_old.py stored the submit date
+LEGACY_SQL = "SELECT * FROM form_submission WHERE id > ? ORDER BY id LIMIT ?"
+TRUE_VALUES = {"1", "on", "true", "yes", "y"}
+BATCH_SIZE = 200
+
+
+# Legacy rows in id order, read in chunks; positions are the legacy ids
+def legacy_rows(path, after=0, size=1000):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        while True:
+            rows = conn.execute(LEGACY_SQL, (after, size)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield row["id"], dict(row)
+            after = rows[-1]["id"]
+    finally:
+        conn.close()
+
+
+# CSV rows with a header naming the form fields (plus date or created_at); positions are row numbers
+def csv_rows(path, after=0):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for position, row in enumerate(csv.DictReader(f), 1):
+            if position > after:
+                yield position, row
+
+
+def parse_date(value):
+    value = (value or "").strip()
+    if not value:
+        return None
+    try:
+        parsed = datetime.strptime(value, LEGACY_DATE_FORMAT)
+    except ValueError:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    # Naive dates were written in the server's local time
+    return (parsed if parsed.tzinfo else parsed.astimezone()).astimezone(timezone.utc).isoformat()
+
+
+# Turn a historical row into the row /submit would have stored; returns (row, None) or (None, errors)
+def to_row(raw):
+    form_data = {f.name: str(raw[f.name]).strip() for f in FIELDS if f.kind != "checkbox" and raw.get(f.name) is not None}
+    errors = validate(form_data)
+    try:
+        created_at = parse_date(raw.get("created_at") or raw.get("date"))
+    except ValueError:
+        errors["created_at"] = "Unrecognised date."
+    if errors:
+        return None, errors
+    row = {
+        f.name: str(raw.get(f.name) or "").strip().lower() in TRUE_VALUES if f.kind == "checkbox" else form_data[f.name]
+        for f in FIELDS if f.stored
+    }
+    row["created_at"] = created_at or datetime.now(timezone.utc).isoformat()
+    # Same content and date -> same key, whichever source or run it comes from
+    digest = hashlib.sha256(json.dumps([row[c] for c in (*COLUMNS, "created_at")]).encode()).hexdigest()
+    row["idempotency_key"] = BACKFILL_KEY_PREFIX + digest[:32]
+    return row, None
+
+
+# Stand-in for Supabase: writes the batch into a local store, whose reconciler pushes it on later
+class LocalTarget:
+    def __init__(self, local_store: LocalStore):
+        self.local_store = local_store
+
+    async def upsert_many(self, rows):
+        await asyncio.to_thread(self.local_store.add_many, rows)
+
+
+# Highest position below which every batch has been written; saved so a rerun resumes there
+class Checkpoint:
+    def __init__(self, path, source):
+        self.path = path
+        self.source = source
+        self.position = 0
+        self._done = {}  # batch number -> last position, for batches finished out of order
+        self._next = 0
+        if path and os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            if state.get("source") != source:
+                raise SystemExit(f"checkpoint {path} belongs to {state.get('source')}, not {source}")
+            self.position = state["position"]
+
+    def done(self, number, last_position):
+        self._done[number] = last_position
+        while self._next in self._done:
+            self.position = self._done.pop(self._next)
+            self._next += 1
+        self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"source": self.source, "position": self.position}, f)
+        os.replace(tmp, self.path)
+
+
+class Progress:
+    def __init__(self, every=2.0, file=sys.stderr):
+        self.every = every
+        self.file = file
+        self.started = self.reported = time.monotonic()
+        self.read = self.invalid = self.written = 0
+
+    def report(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.reported < self.every:
+            return
+        self.reported = now
+        elapsed = max(now - self.started, 1e-9)
+        print(f"read {self.read}  invalid {self.invalid}  written {self.written}  "
+              f"{self.written / elapsed:.0f} rows/s  {elapsed:.1f}s", file=self.file)
+
+
+def batches(rows, size, rejects=None, progress=None):
+    batch, last = [], None
+    for position, raw in rows:
+        row, errors = to_row(raw)
+        if progress:
+            progress.read += 1
+        if errors:
+            if progress:
+                progress.invalid += 1
+            if rejects:
+                rejects.write(json.dumps({"position": position, "row": raw, "errors": errors}, default=str) + "\n")
+        else:
+            batch.append(row)
+        last = position
+        if len(batch) >= size:
+            yield batch, last
+            batch = []
+    if last is not None:
+        # The final (possibly empty) batch still moves the checkpoint past trailing invalid rows
+        yield batch, last
+
+
+# Read, validate and write with up to `parallel` batch upserts in flight
+async def backfill(rows, target, checkpoint: Checkpoint, batch_size=BATCH_SIZE, parallel=4, retries=3, rejects=None, progress=None):
+    queue = asyncio.Queue(maxsize=parallel * 2)
+    failure = None
+
+    async def writer():
+        nonlocal failure
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            if failure is not None:
+                continue  # stopping, drop what is still queued
+            number, batch, last = item
+            for attempt in range(retries + 1):
+                try:
+                    if batch:
+                        await target.upsert_many(batch)
+                    break
+                except Exception as e:
+                    if attempt == retries:
+                        failure = e
+                        break
+                    print(f"Batch ending at {last} failed, retrying:", repr(e), file=sys.stderr)
+                    await asyncio.sleep(2 ** attempt)
+            if failure is not None:
+                continue
+            checkpoint.done(number, last)
+            if progress:
+                progress.written += len(batch)
+                progress.report()
+
+    writers = [asyncio.create_task(writer()) for _ in range(parallel)]
+    # Reading and validating is synchronous, it runs whenever the writers are waiting on the network
+    for number, (batch, last) in enumerate(batches(rows, batch_size, rejects, progress)):
+        await queue.put((number, batch, last))
+        if failure is not None:
+            break
+    for _ in writers:
+        await queue.put(None)
+    await asyncio.gather(*writers)
+    if failure is not None:
+        # Everything before the checkpoint is written, a rerun carries on from there
+        raise failure
+    if progress:
+        progress.report(force=True)
+    return checkpoint.position
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill historical research form submissions")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--legacy-db", help="legacy SQLite database from main_old.py (table form_submission)")
+    source.add_argument("--csv", help="CSV file with the form fields and date/created_at as columns")
+    parser.add_argument("--target", choices=("supabase", "local"), default="supabase",
+                        help="upsert into Supabase, or into the local store (the reconciler syncs it later)")
+    parser.add_argument("--db", help="local SQLite store for --target local (default: $LOCAL_DB or researchform_local.db)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="rows per multi-row upsert")
+    parser.add_argument("--parallel", type=int, default=4, help="batch upserts in flight at once")
+    parser.add_argument("--checkpoint", help="file recording progress; a rerun resumes after it")
+    parser.add_argument("--rejects", help="JSONL file for rows that fail validation")
+    args = parser.parse_args()
+
+    path = os.path.abspath(args.legacy_db or args.csv)
+    checkpoint = Checkpoint(args.checkpoint, f"{'legacy' if args.legacy_db else 'csv'}:{path}")
+    rows = legacy_rows(path, checkpoint.position) if args.legacy_db else csv_rows(path, checkpoint.position)
+    if args.target == "local":
+        target = LocalTarget(LocalStore(args.db) if args.db else LocalStore())
+    else:
+        from store import SupabaseStore
+        target = SupabaseStore()
+    if checkpoint.position:
+        print(f"Resuming after {checkpoint.position}", file=sys.stderr)
+
+    rejects = open(args.rejects, "a") if args.rejects else None
+    progress = Progress()
+    try:
+        position = asyncio.run(backfill(rows, target, checkpoint, args.batch_size, args.parallel, rejects=rejects, progress=progress))
+    finally:
+        if rejects:
+            rejects.close()
+    print(f"Backfilled {progress.written} rows ({progress.invalid} invalid) up to {position}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
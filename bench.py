@@ -0,0 +1,287 @@
+import argparse
+import asyncio
+import json
+import os  # get environment variables
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+# Benchmark harness for GET / and POST /submit: runs the app in-process under uvicorn with
+# Supabase and SMTP replaced by stand-ins, then drives it at increasing concurrency.
+#   python bench.py --concurrency 1 8 32 64 --requests 500 --supabase-latency 80 --smtp-latency 300
+# With --workers N the app runs as N uvicorn worker processes sharing state (see shared_state.py)
+
+VALID = {
+    "full_name": "Jane Doe", "title": "Resident", "dept": "Family Medicine",
+    "research_type": "Case Reports", "email": "jane.doe@example.org",
+    "description": "Retrospective review of sepsis bundle compliance", "post_forum": "on",
+}
+# Invalid submissions rotate through the usual mistakes
+INVALID = [
+    {**VALID, "email": "not-an-email"},
+    {**VALID, "full_name": ""},
+    {k: v for k, v in VALID.items() if k != "dept"},
+    {**VALID, "research_type": "Unknown"},
+]
+
+
+# Supabase stand-in: same upsert_many() as SupabaseStore, with a fixed network delay
+class FakeSupabase:
+    def __init__(self, latency):
+        self.latency = latency
+        self.next_id = 0
+
+    async def upsert_many(self, rows):
+        await asyncio.sleep(self.latency)
+        data = []
+        for row in rows:
+            self.next_id += 1
+            data.append({**row, "id": self.next_id})
+        return SimpleNamespace(data=data)
+
+
+# SMTP stand-in: same interface as outbox.SMTPConnection, blocking for the configured time
+class FakeSMTP:
+    server = None
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.sent = 0
+
+    def send(self, message):
+        time.sleep(self.latency)
+        self.sent += 1
+
+    def close(self):
+        pass
+
+
+# Measures how long the server's event loop is held up: sleeps in short ticks and adds up the overshoot
+class LoopLagMonitor:
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.reset()
+
+    def reset(self):
+        self.blocked = 0.0
+        self.worst = 0.0
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = loop.time() - start - self.interval
+            if lag > 0.001:
+                self.blocked += lag
+                self.worst = max(self.worst, lag)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def bench_env(args):
+    # Point the app at throwaway local state before it is imported
+    os.environ.setdefault("SUPABASE_URL_RC", "http://127.0.0.1:9")
+    os.environ.setdefault("SUPABASE_KEY_RC", "bench.bench.bench")
+    os.environ["LOCAL_DB"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+    # All traffic comes from one IP and mostly one email, keep admission control out of the way
+    for name in ("RATE_IP_PER_MINUTE", "RATE_IP_BURST", "RATE_EMAIL_PER_HOUR", "RATE_EMAIL_BURST", "MAX_IN_FLIGHT"):
+        os.environ.setdefault(name, "1000000")
+    os.environ["STARTUP_WARM"] = "0"  # the stand-ins need no warming up
+    os.environ["BENCH_SUPABASE_LATENCY"] = str(args.supabase_latency / 1000)
+    os.environ["BENCH_SMTP_LATENCY"] = str(args.smtp_latency / 1000)
+
+
+def install_fakes(main):
+    fake_supabase = FakeSupabase(float(os.environ["BENCH_SUPABASE_LATENCY"]))
+    main.store = fake_supabase
+    main.reconciler.remote = fake_supabase
+    main.outbox.connection = FakeSMTP(float(os.environ["BENCH_SMTP_LATENCY"]))
+
+
+# App factory for --workers, each worker process imports the app and swaps in the stand-ins itself
+def create_app():
+    import main
+    install_fakes(main)
+    return main.app
+
+
+def start_server(args):
+    bench_env(args)
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    if args.workers > 1:
+        return start_workers(args, port, base_url)
+    import uvicorn
+    import main
+    install_fakes(main)
+
+    monitor = LoopLagMonitor()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning", access_log=False))
+    server.install_signal_handlers = lambda: None  # running in a thread
+
+    async def serve():
+        lag = asyncio.create_task(monitor.run())
+        await server.serve()
+        lag.cancel()
+
+    thread = threading.Thread(target=asyncio.run, args=(serve(),), daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    def stop():
+        server.should_exit = True
+        thread.join(timeout=15)
+
+    return stop, monitor, base_url
+
+
+def start_workers(args, port, base_url):
+    env = {**os.environ, "WEB_CONCURRENCY": str(args.workers)}
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", "bench:create_app", "--factory", "--host", "127.0.0.1",
+                                "--port", str(port), "--workers", str(args.workers), "--log-level", "warning", "--no-access-log"], env=env)
+    import httpx
+    deadline = time.monotonic() + 60
+    while True:
+        try:
+            httpx.get(base_url + "/").raise_for_status()
+            break
+        except httpx.HTTPError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                raise SystemExit("workers did not start")
+            time.sleep(0.2)
+
+    def stop():
+        process.terminate()
+        process.wait(timeout=30)
+
+    return stop, None, base_url
+
+
+def pick_request(rng, args, n):
+    r = rng.random()
+    if r < args.get_ratio:
+        return "GET", "/", None
+    if r < args.get_ratio + (1 - args.get_ratio) * args.invalid_ratio:
+        return "POST", "/submit", rng.choice(INVALID)
+    # Distinct content so duplicate suppression doesn't short-circuit the valid submissions
+    return "POST", "/submit", {**VALID, "description": f"{VALID['description']} #{n}"}
+
+
+async def run_level(base_url, concurrency, args):
+    import httpx
+    rng = random.Random(args.seed)
+    plan = [pick_request(rng, args, f"{concurrency}-{n}") for n in range(args.requests)]
+    latencies = {"GET /": [], "POST /submit": []}
+    errors = 0
+    position = 0
+
+    async def worker(client):
+        nonlocal errors, position
+        while position < len(plan):
+            method, path, data = plan[position]
+            position += 1
+            start = time.perf_counter()
+            try:
+                r = await client.request(method, path, data=data)
+                ok = r.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            elapsed = time.perf_counter() - start
+            if ok:
+                latencies[f"{method} {path}"].append(elapsed)
+            else:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*[worker(client) for _ in range(concurrency)])
+        wall = time.perf_counter() - start
+    return latencies, errors, wall
+
+
+def summarize(samples):
+    if len(samples) < 2:
+        return {"count": len(samples)}
+    q = statistics.quantiles(samples, n=100)
+    return {"count": len(samples), "p50_ms": round(q[49] * 1000, 2), "p95_ms": round(q[94] * 1000, 2), "p99_ms": round(q[98] * 1000, 2)}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the research form endpoints")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--requests", type=int, default=500, help="requests per concurrency level")
+    parser.add_argument("--get-ratio", type=float, default=0.5, help="share of requests that are GET /")
+    parser.add_argument("--invalid-ratio", type=float, default=0.2, help="share of submissions that fail validation")
+    parser.add_argument("--supabase-latency", type=float, default=80, help="stand-in Supabase round trip (ms)")
+    parser.add_argument("--smtp-latency", type=float, default=300, help="stand-in SMTP send time (ms)")
+    parser.add_argument("--workers", type=int, default=1, help="server worker processes (more than 1 runs them with shared state)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="JSON results file (default: bench_results/<commit>.json)")
+    args = parser.parse_args()
+
+    stop, monitor, base_url = start_server(args)
+    results = []
+    try:
+        for concurrency in args.concurrency:
+            if monitor:
+                monitor.reset()
+            latencies, errors, wall = asyncio.run(run_level(base_url, concurrency, args))
+            total = sum(len(v) for v in latencies.values())
+            level = {
+                "concurrency": concurrency,
+                "requests": args.requests,
+                "errors": errors,
+                "requests_per_sec": round(total / wall, 1),
+                "all": summarize([s for v in latencies.values() for s in v]),
+                **{name: summarize(samples) for name, samples in latencies.items()},
+                # Only measured in-process, the worker processes are out of reach
+                "loop_blocked_ms": round(monitor.blocked * 1000, 1) if monitor else None,
+                "loop_worst_stall_ms": round(monitor.worst * 1000, 1) if monitor else None,
+            }
+            results.append(level)
+            blocked = f"{level['loop_blocked_ms']}ms" if monitor else "n/a"
+            print(f"c={concurrency:<4} {level['requests_per_sec']:>8} req/s  p50={level['all'].get('p50_ms')}ms "
+                  f"p95={level['all'].get('p95_ms')}ms p99={level['all'].get('p99_ms')}ms  "
+                  f"loop blocked={blocked}  errors={errors}", file=sys.stderr)
+    finally:
+        stop()
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "config": {k: v for k, v in vars(args).items() if k != "out"},
+        "results": results,
+    }
+    out = args.out or os.path.join("bench_results", f"{(commit or 'unknown')[:12]}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {out}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import asyncio
+import hashlib
+import json
+import os  # get environment variables
+import re
+import time
+from collections import OrderedDict
+
+# How long identical content is remembered, and how many are kept
+DEDUPE_TTL = float(os.environ.get("DEDUPE_TTL", "600"))
+DEDUPE_MAX_ENTRIES = int(os.environ.get("DEDUPE_MAX_ENTRIES", "10000"))
+
+# Tokens are 32 hex characters, generated in the browser when the form loads
+TOKEN_RE = re.compile(r"[0-9a-f]{32}")
+
+
+def valid_token(token):
+    return token if token and TOKEN_RE.fullmatch(token) else None
+
+
+def content_key(submission: dict):
+    return "content:" + hashlib.sha256(json.dumps(submission, sort_keys=True).encode()).hexdigest()
+
+
+# Bounded LRU of recent submissions (by content hash) with their results.
+# A repeated POST gets the original result back; one that arrives while the first is
+# still being saved waits for it instead of saving again.
+class RecentSubmissions:
+    def __init__(self, max_entries=DEDUPE_MAX_ENTRIES, ttl=DEDUPE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires_at, future)
+        self.hits = 0
+
+    def _lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, future = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return future
+
+    def _evict(self):
+        now = time.monotonic()
+        # Oldest entries sit at the front, drop expired ones and then anything over the size cap
+        while self.entries:
+            key, (expires_at, _) = next(iter(self.entries.items()))
+            if expires_at >= now and len(self.entries) <= self.max_entries:
+                break
+            del self.entries[key]
+
+    async def run_once(self, keys, fn):
+        for key in keys:
+            future = self._lookup(key)
+            if future is not None:
+                self.hits += 1
+                return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        expires_at = time.monotonic() + self.ttl
+        for key in keys:
+            self.entries[key] = (expires_at, future)
+        self._evict()
+        try:
+            result = await fn()
+        except BaseException as e:
+            # Failures are not remembered, the next attempt runs for real
+            for key in keys:
+                if self.entries.get(key, (None, None))[1] is future:
+                    del self.entries[key]
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                future.exception()  # mark retrieved when nobody else was waiting
+            raise
+        future.set_result(result)
+        return result
+
+
+# Multi-worker variant: a submission claimed by one worker is recognised by all of them.
+# Within a worker the in-process map still answers first; across workers a resubmission
+# waits for the worker that is saving it and gets the same result back.
+class SharedRecentSubmissions(RecentSubmissions):
+    def __init__(self, shared, max_entries=DEDUPE_MAX_ENTRIES, ttl=DEDUPE_TTL, poll_interval=0.05):
+        super().__init__(max_entries, ttl)
+        self.shared = shared
+        self.poll_interval = poll_interval
+
+    async def run_once(self, keys, fn):
+        async def across_workers():
+            while True:
+                found = await asyncio.to_thread(self.shared.claim_submission, keys)
+                if found is None:
+                    break
+                _, result = found
+                if result is not None:
+                    self.hits += 1
+                    return result
+                # Another worker is saving it right now
+                await asyncio.sleep(self.poll_interval)
+            try:
+                result = await fn()
+            except BaseException:
+                # Shielded so the claim is released even when the request itself was cancelled
+                await asyncio.shield(asyncio.to_thread(self.shared.release_submission, keys))
+                raise
+            await asyncio.to_thread(self.shared.finish_submission, keys, result, self.ttl)
+            return result
+
+        return await super().run_once(keys, across_workers)
@@ -0,0 +1,68 @@
+import asyncio
+import os  # get environment variables
+from datetime import datetime
+import emails
+from local_store import BACKFILL_KEY_PREFIX
+
+# Committee digest interval in minutes; 0 keeps the committee cc'd on every confirmation instead
+DIGEST_MINUTES = float(os.environ.get("COMMITTEE_DIGEST_MINUTES", "0"))
+
+
+# Periodically emails the committee one summary of everything submitted since the last digest.
+# The last included id is kept in the local store, so a restart neither skips nor repeats rows.
+class CommitteeDigest:
+    def __init__(self, local_store, outbox, interval=DIGEST_MINUTES * 60):
+        self.local_store = local_store
+        self.outbox = outbox
+        self.interval = interval
+        self._worker = None
+
+    # Read and advance the watermark in one transaction, so with several workers only one of them sends each digest
+    def _claim(self):
+        conn = self.local_store.conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            last_id = int(self.local_store.get_meta("digest_last_id", 0))
+            since = self.local_store.get_meta("digest_last_at")
+            rows = [row for chunk in self.local_store.chunks(after_id=last_id) for row in chunk]
+            now = datetime.now()
+            if rows:
+                self._advance(rows[-1]["id"], now)
+        # Historical rows imported by backfill.py get new ids but aren't new submissions: move past them unreported
+        return [r for r in rows if not r["idempotency_key"].startswith(BACKFILL_KEY_PREFIX)], since, now
+
+    def _advance(self, last_id, sent_at):
+        self.local_store.set_meta("digest_last_id", last_id)
+        self.local_store.set_meta("digest_last_at", sent_at.isoformat())
+
+    async def send_once(self):
+        rows, since, now = await asyncio.to_thread(self._claim)
+        if not rows:
+            return 0
+        start = datetime.fromisoformat(since) if since else datetime.fromisoformat(rows[0]["created_at"]).astimezone().replace(tzinfo=None)
+        await self.outbox.put(emails.SENDER, [emails.COMMITTEE_EMAIL], emails.digest(rows, start, now))
+        return len(rows)
+
+    async def start(self):
+        # First run: start from the current end of the table rather than digesting the whole history
+        if self.local_store.get_meta("digest_last_id") is None:
+            await asyncio.to_thread(self._advance, self.local_store.max_id(), datetime.now())
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.send_once()
+            except Exception as e:
+                print("Committee digest failed:", repr(e))
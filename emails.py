@@ -0,0 +1,73 @@
+import os  # get environment variables
+from datetime import datetime  # For getting the current date and time
+from itertools import groupby
+from string import Template
+
+SENDER = 'admin@samcresearchforum.org'
+# Research committee inbox: cc'd on every confirmation, or sent periodic digests in digest mode
+COMMITTEE_EMAIL = os.environ.get("COMMITTEE_EMAIL", "phillip.kim@samc.com")
+
+# Templates are parsed once at import, each email only substitutes values
+CONFIRMATION = Template(
+    "Dear $name, \nYour submission for $research_type with the following description:\n\n"
+    "Submit Date: $date\nDepartment: $dept\nDescription: $description\nSubmit to Research Forum: $post_forum\n\n"
+    "Thank you for your submission. Please let us know if you have any questions. \n"
+    "Sincerely,\nSAMC Research Committee"
+)
+DIGEST = Template(
+    "Scholarly activity submissions received $start to $end: $count in total.\n\n"
+    "$sections\n"
+    "SAMC Research Form"
+)
+DIGEST_SECTION = Template("$dept / $research_type ($count)\n$entries\n")
+DIGEST_ENTRY = Template("  - $name ($title), $email, posted $date, research forum: $post_forum\n    $description\n")
+
+DATE_FORMAT = "%m/%d/%Y, %H:%M:%S"
+
+
+def _message(to, subject, body):
+    # Imported with the first email rather than at startup
+    from email.mime.text import MIMEText
+    from email.mime.multipart import MIMEMultipart
+    msg = MIMEMultipart()
+    msg['From'] = SENDER
+    msg['To'] = to
+    msg['Subject'] = subject
+    msg.attach(MIMEText(body, 'plain'))
+    return msg.as_string()
+
+
+# Confirmation for the submitter; the date is taken when the email is built, not at import
+def confirmation(data: dict, submitted_at=None):
+    body = CONFIRMATION.substitute(
+        name=data['full_name'].title(),
+        research_type=data['research_type'],
+        date=(submitted_at or datetime.now()).strftime(DATE_FORMAT),
+        dept=data['dept'],
+        description=data['description'],
+        post_forum=data['post_forum'],
+    )
+    return _message(data['email'], 'Scholarly Activity Submission', body)
+
+
+def _date(created_at):
+    try:
+        return datetime.fromisoformat(created_at).astimezone().strftime(DATE_FORMAT)
+    except (TypeError, ValueError):
+        return created_at
+
+
+# One summary email for the committee, grouped by department and research type
+def digest(rows, start, end):
+    key = lambda r: (r['dept'], r['research_type'])
+    sections = []
+    for (dept, research_type), group in groupby(sorted(rows, key=key), key=key):
+        group = list(group)
+        entries = "".join(DIGEST_ENTRY.substitute(
+            name=r['full_name'], title=r['title'], email=r['email'], date=_date(r['created_at']),
+            post_forum="Yes" if r['post_forum'] else "No",
+            description=" ".join(r['description'].split())[:300],
+        ) for r in group)
+        sections.append(DIGEST_SECTION.substitute(dept=dept, research_type=research_type, count=len(group), entries=entries))
+    body = DIGEST.substitute(start=start.strftime(DATE_FORMAT), end=end.strftime(DATE_FORMAT), count=len(rows), sections="".join(sections))
+    return _message(COMMITTEE_EMAIL, f'Scholarly Activity Submissions Digest ({len(rows)})', body)
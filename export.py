@@ -0,0 +1,135 @@
+import argparse
+import csv
+import importlib.util
+import io
+import json
+import sys
+from local_store import LocalStore, COLUMNS, BOOL_COLUMNS
+
+# Export columns: local id (the incremental watermark), Supabase id, the form fields and the submit time
+EXPORT_COLUMNS = ("id", "remote_id", *COLUMNS, "created_at")
+FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "jsonl": ("application/x-ndjson", "jsonl"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+CHUNK_SIZE = 1000
+
+
+def csv_stream(chunks):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in chunks:
+        writer.writerows([r[c] for c in EXPORT_COLUMNS] for r in rows)
+        yield buf.getvalue().encode()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode()
+
+
+def jsonl_stream(chunks):
+    for rows in chunks:
+        yield "".join(json.dumps({c: r[c] for c in EXPORT_COLUMNS}) + "\n" for r in rows).encode()
+
+
+# File-like sink that hands back whatever pyarrow has written since the last call
+class _Drain(io.RawIOBase):
+    def __init__(self):
+        self.parts = []
+        self.pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.parts.append(bytes(b))
+        self.pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self.pos
+
+    def take(self):
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+
+def parquet_stream(chunks):
+    # One row group per chunk, flushed to the client as soon as it is written
+    import pyarrow as pa  # optional dependency, only needed for parquet exports
+    import pyarrow.parquet as pq
+    schema = pa.schema([
+        ("id", pa.int64()), ("remote_id", pa.int64()),
+        *[(c, pa.bool_() if c in BOOL_COLUMNS else pa.string()) for c in COLUMNS],
+        ("created_at", pa.string()),
+    ])
+    sink = _Drain()
+    with pq.ParquetWriter(sink, schema) as writer:
+        for rows in chunks:
+            writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+            yield sink.take()
+    yield sink.take()
+
+
+STREAMS = {"csv": csv_stream, "jsonl": jsonl_stream, "parquet": parquet_stream}
+
+
+def available(fmt):
+    return fmt in STREAMS and (fmt != "parquet" or importlib.util.find_spec("pyarrow") is not None)
+
+
+# Stream every submission after the watermark (local id and/or created_at) in the given format
+def export(local_store, fmt, since_id=0, since="", chunk_size=CHUNK_SIZE):
+    return STREAMS[fmt](local_store.chunks(after_id=since_id, since=since, size=chunk_size))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export research form submissions from the local store")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--out", help="output file (default: stdout)")
+    parser.add_argument("--db", help="local SQLite store (default: $LOCAL_DB or researchform_local.db)")
+    parser.add_argument("--since", default="", help="only rows created at or after this ISO date/time (backfilled rows keep their original dates, use --since-id/--state to include them)")
+    parser.add_argument("--since-id", type=int, default=0, help="only rows with a local id above this")
+    parser.add_argument("--state", help="file holding the last exported id; read as --since-id and updated after the export")
+    args = parser.parse_args()
+    if not available(args.format):
+        parser.error("parquet export needs pyarrow (pip install pyarrow)")
+
+    since_id = args.since_id
+    if args.state:
+        try:
+            with open(args.state) as f:
+                since_id = max(since_id, int(f.read().strip() or 0))
+        except FileNotFoundError:
+            pass
+
+    local_store = LocalStore(args.db) if args.db else LocalStore()
+    # Track the highest id that went out so the next incremental export starts after it
+    last_id = since_id
+
+    def tracked(chunks):
+        nonlocal last_id
+        for rows in chunks:
+            last_id = rows[-1]["id"]
+            yield rows
+
+    stream = STREAMS[args.format](tracked(local_store.chunks(after_id=since_id, since=args.since, size=CHUNK_SIZE)))
+    out = open(args.out, "wb") if args.out else sys.stdout.buffer
+    try:
+        for data in stream:
+            out.write(data)
+    finally:
+        if args.out:
+            out.close()
+
+    if args.state:
+        with open(args.state, "w") as f:
+            f.write(str(last_id))
+    print(f"Exported up to id {last_id}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import re  # For email validation
+from dataclasses import dataclass
+from html import escape
+from fasthtml.common import *
+
+# Option lists for the select fields (edit here, the form and validator follow)
+TITLES = ("Faculty", "Resident", "Student", "Staff", "Other")
+DEPARTMENTS = ("Emergency Medicine", "Family Medicine", "Internal Medicine", "OB/GYN", "Surgery", "Other")
+RESEARCH_TYPES = ("Abstract for Conferences", "Case Reports", "Prosepective Studies", "Retrospective Studies", "QI/PI", "Other")
+
+
+@dataclass(frozen=True)
+class Field:
+    name: str
+    label: str
+    kind: str = "text"  # text, email, select, textarea or checkbox
+    required: bool = True
+    placeholder: str = ""
+    options: tuple = ()
+    stored: bool = True  # False for fields that are shown on the form but not saved
+
+
+# The submission form, in display order
+FIELDS = (
+    Field("full_name", "Full Name", placeholder="Enter your full name"),
+    Field("title", "Select Your Title", "select", placeholder="Select Your Title", options=TITLES),
+    Field("dept", "Department", "select", placeholder="Select Your Department", options=DEPARTMENTS),
+    Field("research_type", "Research Type", "select", placeholder="Select Research Type", options=RESEARCH_TYPES),
+    Field("email", "Email", "email", placeholder="Enter your email"),
+    Field("title_proj", "Project Title", required=False, placeholder="Optional Working Research Project Title", stored=False),
+    Field("description", "Description", "textarea", placeholder="Provide a brief description"),
+    Field("post_forum", "Post to SAMC Research Forum", "checkbox", required=False),
+)
+
+# Simple email validation, compiled once. Addresses must be ASCII, smtplib can't send to anything else
+EMAIL_RE = re.compile(r"[^@]+@[^@]+\.[^@]+")
+
+def is_valid_email(email):
+    return email.isascii() and EMAIL_RE.match(email)
+
+# Messages shown next to a field that fails validation
+REQUIRED_MESSAGE = "This field is required."
+OPTION_MESSAGE = "Please choose one of the options."
+EMAIL_MESSAGE = "Please enter a valid email address."
+
+# name -> (required, allowed values, format check) for every field the validator checks
+_RULES = {
+    f.name: (f.required, frozenset(f.options) if f.options else None, is_valid_email if f.kind == "email" else None)
+    for f in FIELDS if f.kind != "checkbox" and (f.required or f.options or f.kind == "email")
+}
+
+# Error message for one field's value, None when it is fine
+def validate_field(name, value):
+    required, allowed, check = _RULES[name]
+    if not value:
+        return REQUIRED_MESSAGE if required else None
+    if allowed is not None and value not in allowed:
+        return OPTION_MESSAGE
+    if check is not None and not check(value):
+        return EMAIL_MESSAGE
+    return None
+
+# Return {field name: message} for missing or invalid fields, in form order
+def validate(form_data):
+    invalid = {}
+    for name in _RULES:
+        message = validate_field(name, form_data.get(name))
+        if message:
+            invalid[name] = message
+    return invalid
+
+# Build the row saved for a valid submission
+def serialize(form_data):
+    return {
+        f.name: (f.name in form_data) if f.kind == "checkbox" else form_data[f.name]
+        for f in FIELDS if f.stored
+    }
+
+#create a required label asterik
+def required_label(text):
+    return Label(
+        text,
+        Span("*", style="color: red;")
+    )
+
+
+# Hidden one-time token that lets /submit recognise a repeated POST of the same form
+TOKEN_FIELD = "submission_token"
+
+# Markers patched with user values when the form is rendered
+VALUE, CLS, CONTENT, TOKEN = "@@value@@", "@@cls@@", "@@content@@", "@@token@@"
+VALUE_ATTR, CLS_ATTR = f' value="{VALUE}"', f' class="{CLS}"'
+
+def _html(ft):
+    return to_xml(ft, indent=False)
+
+def _split(ft):
+    return tuple(_html(ft).split(CONTENT))
+
+# Fields checked inline (on blur) are wrapped in a div that re-validates itself through HTMX
+def _wrapper(f, oob=False):
+    if f.name not in _RULES:
+        return "", ""
+    trigger = "change" if f.kind == "select" else "focusout"
+    attrs = dict(id=f"field-{f.name}", hx_post=f"/validate/{f.name}", hx_trigger=trigger, hx_target="this", hx_swap="outerHTML")
+    if oob:
+        attrs["hx_swap_oob"] = "true"
+    return _split(Div(**attrs)(CONTENT))
+
+# Pre-render every field once so a request only joins strings
+def _compile(f):
+    label = required_label(f.label) if f.required else f.label
+    if f.kind == "select":
+        head, tail = _split(Label(label, Select(name=f.name, required=f.required, cls=CLS)(CONTENT)))
+        options = {"": (_html(Option(value="", disabled=True)(f.placeholder)), _html(Option(value="", disabled=True, selected=True)(f.placeholder)))}
+        for o in f.options:
+            options[o] = (_html(Option(value=o)(o)), _html(Option(value=o, selected=True)(o)))
+        return head, options, tail
+    if f.kind == "checkbox":
+        return _html(Label(Input(type="checkbox", name=f.name), f.label)), _html(Label(Input(type="checkbox", name=f.name, checked=True), f.label))
+    if f.kind == "textarea":
+        return _html(Label(label, Textarea(name=f.name, required=f.required, placeholder=f.placeholder, cls=CLS)(VALUE)))
+    return _html(Label(label, Input(type=f.kind, name=f.name, required=f.required, placeholder=f.placeholder, value=VALUE, cls=CLS)))
+
+_FRAGMENTS = {f.name: (f, _compile(f), _wrapper(f), _wrapper(f, oob=True)) for f in FIELDS}
+_FORM_HEAD, _FORM_TAIL = _split((Form(method="post", action="/submit", hx_post="/submit", hx_target="body")(
+    Input(type="hidden", name=TOKEN_FIELD, value=TOKEN),
+    Div(id="form-status"),
+    Fieldset(
+        CONTENT,
+        # Add the required notice at the bottom of the form
+        P("* Required", style="color: red; font-style: italic;")
+    ),
+    Button(type="submit")("Submit")
+),
+# The page itself is cached, so each page load picks its own token in the browser
+Script(f"""document.querySelectorAll('input[name={TOKEN_FIELD}]').forEach(i => {{
+    if (!i.value) i.value = Array.from(crypto.getRandomValues(new Uint8Array(16)), b => b.toString(16).padStart(2, '0')).join('');
+}});""")))
+
+# Render one field with the user's value, highlighted in red with its message when invalid
+def render_field(name, values=None, errors=None, oob=False):
+    values = values or {}
+    errors = errors or {}
+    f, fragment, wrapper, oob_wrapper = _FRAGMENTS[name]
+    cls = ' class="error"' if f.name in errors else ""
+    if f.kind == "select":
+        head, options, tail = fragment
+        current = values.get(f.name) or ""
+        if current not in options:
+            current = ""
+        html = head.replace(CLS_ATTR, cls) + "".join(
+            selected if value == current else plain for value, (plain, selected) in options.items()) + tail
+    elif f.kind == "checkbox":
+        html = fragment[f.name in values]
+    else:
+        value = values.get(f.name) or ""
+        html = fragment.replace(CLS_ATTR, cls)
+        if f.kind != "textarea" and not value:
+            html = html.replace(VALUE_ATTR, "")
+        html = html.replace(VALUE, escape(value))
+    head, tail = oob_wrapper if oob else wrapper
+    message = errors.get(f.name) if isinstance(errors, dict) else None
+    if message:
+        html += f'<small style="color: red;">{escape(message)}</small>'
+    return head + html + tail
+
+# Render the form, blank or with the user's values and the invalid fields highlighted in red
+def render_form(values=None, errors=None):
+    values = values or {}
+    parts = [_FORM_HEAD.replace(TOKEN, escape(values.get(TOKEN_FIELD) or ""))]
+    parts.extend(render_field(name, values, errors) for name in _FRAGMENTS)
+    parts.append(_FORM_TAIL)
+    return NotStr("".join(parts))
+
+# Out-of-band fragments for an HTMX submit that failed validation: the message and the invalid fields only
+def render_errors(values, errors):
+    status = '<div id="form-status" hx-swap-oob="true"><p style="color: red;">Please fill out all required fields or correct errors.</p></div>'
+    return status + "".join(render_field(name, values, errors, oob=True) for name in errors)
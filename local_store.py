@@ -0,0 +1,322 @@
+import asyncio
+import os  # get environment variables
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timezone
+from form_schema import FIELDS
+from store import RowsRejected, SchemaError
+import metrics
+
+# Local SQLite copy of every submission, written first so /submit works while Supabase is down
+LOCAL_DB_PATH = os.environ.get("LOCAL_DB", "researchform_local.db")
+
+# Columns saved with each submission, straight from the form schema
+COLUMNS = tuple(f.name for f in FIELDS if f.stored)
+BOOL_COLUMNS = frozenset(f.name for f in FIELDS if f.stored and f.kind == "checkbox")
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS researchform (
+    id INTEGER PRIMARY KEY,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    remote_id INTEGER,
+    {", ".join(f"{c} INTEGER NOT NULL DEFAULT 0" if c in BOOL_COLUMNS else f"{c} TEXT" for c in COLUMNS)},
+    created_at TEXT NOT NULL,
+    synced_at TEXT
+);
+CREATE INDEX IF NOT EXISTS researchform_unsynced ON researchform (id) WHERE synced_at IS NULL;
+CREATE INDEX IF NOT EXISTS researchform_email ON researchform (email, id);
+CREATE INDEX IF NOT EXISTS researchform_dept ON researchform (dept, id);
+CREATE INDEX IF NOT EXISTS researchform_research_type ON researchform (research_type, id);
+CREATE INDEX IF NOT EXISTS researchform_title ON researchform (title, id);
+CREATE INDEX IF NOT EXISTS researchform_created_at ON researchform (created_at);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS sync_rejects (
+    idempotency_key TEXT PRIMARY KEY,
+    error TEXT NOT NULL,
+    rejected_at TEXT NOT NULL
+);
+"""
+
+# Full-text index over the description, kept in step with the table by triggers.
+# Separate statements, run inside one transaction with the existence check
+FTS_SCHEMA = (
+    "CREATE VIRTUAL TABLE researchform_fts USING fts5(description, content='researchform', content_rowid='id')",
+    """CREATE TRIGGER researchform_fts_insert AFTER INSERT ON researchform BEGIN
+    INSERT INTO researchform_fts (rowid, description) VALUES (new.id, new.description);
+END""",
+    """CREATE TRIGGER researchform_fts_delete AFTER DELETE ON researchform BEGIN
+    INSERT INTO researchform_fts (researchform_fts, rowid, description) VALUES ('delete', old.id, old.description);
+END""",
+    """CREATE TRIGGER researchform_fts_update AFTER UPDATE OF description ON researchform BEGIN
+    INSERT INTO researchform_fts (researchform_fts, rowid, description) VALUES ('delete', old.id, old.description);
+    INSERT INTO researchform_fts (rowid, description) VALUES (new.id, new.description);
+END""",
+    "INSERT INTO researchform_fts (researchform_fts) VALUES ('rebuild')",
+)
+FTS_EXISTS_SQL = "SELECT 1 FROM sqlite_master WHERE name = 'researchform_fts'"
+
+# Columns the admin listing can filter on with an exact match
+FILTER_COLUMNS = ("dept", "research_type", "title", "post_forum")
+
+# Statements are constant strings so sqlite3's statement cache keeps them prepared
+INSERT_SQL = f"INSERT OR IGNORE INTO researchform (idempotency_key, {', '.join(COLUMNS)}, created_at) VALUES (?, {', '.join('?' * len(COLUMNS))}, ?)"
+GET_SQL = "SELECT * FROM researchform WHERE idempotency_key = ?"
+UNSYNCED_SQL = "SELECT * FROM researchform WHERE synced_at IS NULL AND idempotency_key NOT IN (SELECT idempotency_key FROM sync_rejects) ORDER BY id LIMIT ?"
+REJECT_SQL = "INSERT OR REPLACE INTO sync_rejects (idempotency_key, error, rejected_at) VALUES (?, ?, ?)"
+REJECTED_SQL = "SELECT r.*, s.error, s.rejected_at FROM researchform r JOIN sync_rejects s USING (idempotency_key) ORDER BY r.id"
+MARK_SYNCED_SQL = "UPDATE researchform SET remote_id = ?, synced_at = ? WHERE idempotency_key = ?"
+MAX_ID_SQL = "SELECT COALESCE(MAX(id), 0) FROM researchform"
+GET_META_SQL = "SELECT value FROM meta WHERE key = ?"
+SET_META_SQL = "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value"
+CHUNK_SQL = "SELECT * FROM researchform WHERE id > ? AND created_at >= ? ORDER BY id LIMIT ?"
+
+
+# Idempotency keys of historical rows imported by backfill.py, so live-only jobs can tell them apart
+BACKFILL_KEY_PREFIX = "backfill-"
+
+
+def now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class LocalStore:
+    def __init__(self, path=LOCAL_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        conn = self.conn()
+        conn.executescript(SCHEMA)
+        if conn.execute(FTS_EXISTS_SQL).fetchone() is None:
+            # Several workers can open a fresh database at once: check again under the write lock
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                if conn.execute(FTS_EXISTS_SQL).fetchone() is None:
+                    for statement in FTS_SCHEMA:
+                        conn.execute(statement)
+
+    def conn(self):
+        # One connection per thread (requests run on the thread pool), WAL lets readers and the writer overlap
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            # FULL syncs the WAL on every commit: an accepted submission may exist nowhere else yet
+            conn.execute("PRAGMA synchronous=FULL")
+            self._local.conn = conn
+        return conn
+
+    def _row(self, row):
+        if row is None:
+            return None
+        row = dict(row)
+        for c in BOOL_COLUMNS:
+            row[c] = bool(row[c])
+        return row
+
+    def add(self, submission: dict, idempotency_key=None):
+        # The same key is sent to Supabase, so a row is only ever created once there
+        key = idempotency_key or uuid.uuid4().hex
+        conn = self.conn()
+        conn.execute(INSERT_SQL, (key, *(submission.get(c) for c in COLUMNS), now()))
+        row = self._row(conn.execute(GET_SQL, (key,)).fetchone())
+        if idempotency_key and any(row[c] != submission.get(c) for c in COLUMNS):
+            # The key was already used for different content (a form token reused after the dedupe
+            # window): that is a new submission, not a repeat, so it gets a key of its own
+            return self.add(submission)
+        return row
+
+    def add_many(self, rows):
+        # Bulk imports: rows carry their own idempotency_key and created_at, one transaction per batch.
+        # IMMEDIATE takes the write lock up front, so parallel batches wait on the busy timeout instead
+        # of failing with "database is locked" when a read lock can't be upgraded
+        conn = self.conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(INSERT_SQL, [(r["idempotency_key"], *(r.get(c) for c in COLUMNS), r["created_at"]) for r in rows])
+
+    def get(self, idempotency_key):
+        return self._row(self.conn().execute(GET_SQL, (idempotency_key,)).fetchone())
+
+    def unsynced(self, limit=50):
+        return [self._row(r) for r in self.conn().execute(UNSYNCED_SQL, (limit,))]
+
+    def mark_synced(self, rows):
+        # rows: (idempotency_key, remote_id) pairs
+        synced_at = now()
+        conn = self.conn()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(MARK_SYNCED_SQL, [(remote_id, synced_at, key) for key, remote_id in rows])
+
+    # Rows Supabase refused on their own are set aside so the rest of the queue keeps moving.
+    # They stay unsynced; deleting them from sync_rejects (once fixed) puts them back in the queue.
+    def reject(self, rows):
+        # rows: (idempotency_key, error) pairs
+        rejected_at = now()
+        conn = self.conn()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(REJECT_SQL, [(key, error, rejected_at) for key, error in rows])
+
+    def rejected(self):
+        return [self._row(r) for r in self.conn().execute(REJECTED_SQL)]
+
+    def max_id(self):
+        return self.conn().execute(MAX_ID_SQL).fetchone()[0]
+
+    # Small key/value table for watermarks kept by background jobs
+    def get_meta(self, key, default=None):
+        row = self.conn().execute(GET_META_SQL, (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        self.conn().execute(SET_META_SQL, (key, str(value)))
+
+    def chunks(self, after_id=0, since="", size=1000):
+        # Oldest first in fixed-size chunks, each one its own short query, so exports never hold the table in memory
+        while True:
+            rows = [self._row(r) for r in self.conn().execute(CHUNK_SQL, (after_id, since, size))]
+            if not rows:
+                return
+            yield rows
+            after_id = rows[-1]["id"]
+
+    def search(self, filters=None, q="", since=None, until=None, before_id=None, limit=50):
+        # Newest first, paginated by id (keyset) so deep pages cost the same as the first one
+        where, params = [], []
+        for column, value in (filters or {}).items():
+            if column in FILTER_COLUMNS and value not in (None, ""):
+                where.append(f"{column} = ?")
+                params.append(value)
+        if since:
+            where.append("created_at >= ?")
+            params.append(since)
+        if until:
+            where.append("created_at < ?")
+            params.append(until)
+        if q:
+            where.append("id IN (SELECT rowid FROM researchform_fts WHERE researchform_fts MATCH ?)")
+            params.append(fts_query(q))
+        if before_id:
+            where.append("id < ?")
+            params.append(before_id)
+        sql = "SELECT * FROM researchform" + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY id DESC LIMIT ?"
+        rows = [self._row(r) for r in self.conn().execute(sql, (*params, limit + 1))]
+        # One extra row tells us whether there is a next page
+        next_before = rows[limit - 1]["id"] if len(rows) > limit else None
+        return rows[:limit], next_before
+
+
+# Quote each search word so user input is never parsed as FTS5 query syntax
+def fts_query(q):
+    return " ".join('"' + word.replace('"', '""') + '"' for word in q.split())
+
+
+# Shape of a local row as sent to Supabase
+def to_remote(row):
+    return {**{c: row[c] for c in COLUMNS}, "idempotency_key": row["idempotency_key"], "created_at": row["created_at"]}
+
+
+# Pushes locally accepted submissions that haven't reached Supabase yet, in multi-row batches.
+# With several workers (shared state given) only the one holding the reconciler lease syncs,
+# otherwise every worker would upsert the same unsynced rows.
+class Reconciler:
+    def __init__(self, local: LocalStore, remote, shared=None, batch_size=50, interval=5.0):
+        self.local = local
+        self.remote = remote
+        self.shared = shared
+        self.holder = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.batch_size = batch_size
+        self.interval = interval
+        self.synced = 0
+        self._pending = 0
+        self._lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._worker = None
+
+    def notify(self):
+        # Called for each new unsynced row, flush early once a full batch is waiting
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self._wake.set()
+
+    async def sync_once(self):
+        async with self._lock:
+            if self.shared is not None and not await asyncio.to_thread(self.shared.hold_lease, "reconciler", self.holder, self.interval * 3):
+                return 0
+            rows = await asyncio.to_thread(self.local.unsynced, self.batch_size)
+            if not rows:
+                self._pending = 0
+                return 0
+            try:
+                response = await self.remote.upsert_many([to_remote(r) for r in rows])
+            except RowsRejected:
+                # One bad row fails the whole batch, every tick: find it by sending the rows one at a time
+                await self._sync_each(rows)
+                return len(rows)
+            synced = [(r["idempotency_key"], r["id"]) for r in response.data]
+            await self._synced(synced)
+            return len(rows)
+
+    async def _sync_each(self, rows):
+        synced, rejected = [], []
+        try:
+            for row in rows:
+                try:
+                    response = await self.remote.upsert_many([to_remote(row)])
+                except RowsRejected as e:
+                    print(f"Supabase rejected local submission {row['id']}, set aside:", repr(e))
+                    metrics.supabase_errors.inc("rejected")
+                    rejected.append((row["idempotency_key"], repr(e)))
+                    continue
+                synced += [(r["idempotency_key"], r["id"]) for r in response.data]
+        finally:
+            # Keep what got through even when Supabase goes away halfway, the rest is retried next tick
+            await asyncio.to_thread(self.local.reject, rejected)
+            await self._synced(synced)
+
+    async def _synced(self, synced):
+        await asyncio.to_thread(self.local.mark_synced, synced)
+        self.synced += len(synced)
+        self._pending = max(0, self._pending - len(synced))
+
+    async def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        # Last attempt before shutdown, anything left is picked up on the next start
+        try:
+            await self.sync_once()
+        except Exception as e:
+            print("Sync to Supabase failed on shutdown:", repr(e))
+        if self.shared is not None:
+            # Let another worker take over right away
+            await asyncio.to_thread(self.shared.release_lease, "reconciler", self.holder)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                # Keep going while full batches are waiting
+                while await self.sync_once() >= self.batch_size:
+                    pass
+            except SchemaError:
+                # Already reported by the store, rows wait locally until the migration is applied
+                metrics.supabase_errors.inc("reconcile")
+            except Exception as e:
+                # Rows stay unsynced locally and are retried on the next tick
+                print("Sync to Supabase failed:", repr(e))
+                metrics.supabase_errors.inc("reconcile")
@@ -1,23 +1,54 @@
-from fasthtml.common import *
-from dataclasses import dataclass
-import re  # For email validation
-from datetime import datetime  # For getting the current date and time
-import os # get environment variables
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from supabase import create_client, Client
-
-# Supabase configuration
-SUPABASE_URL = os.environ.get("SUPABASE_URL_RC")
-SUPABASE_KEY = os.environ.get("SUPABASE_KEY_RC")
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+import startup  # first, so the startup profile covers every import below
+with startup.phase("import fasthtml"):
+    from fasthtml.common import *
+with startup.phase("import app modules"):
+    import asyncio
+    import sqlite3
+    import os # get environment variables
+    from outbox import Outbox, SharedOutbox, SMTPConnection
+    import emails
+    from digest import CommitteeDigest, DIGEST_MINUTES
+    from store import SupabaseStore, SchemaError, WRITE_BEHIND, REMOTE_TIMEOUT
+    from local_store import LocalStore, Reconciler, to_remote
+    from render_cache import RenderCache
+    from static_assets import StaticAssets, StaticAssetsMiddleware
+    from admin import add_admin_routes
+    from form_schema import validate, validate_field, serialize, render_form, render_field, render_errors, TOKEN_FIELD
+    from dedupe import RecentSubmissions, SharedRecentSubmissions, valid_token, content_key
+    from shared_state import SHARED, shared_state
+    import metrics
+    from metrics import MetricsMiddleware, stage
+    from admission import AdmissionMiddleware, RateLimited, check_email, client_ip, ip_limits, too_many
+
+# Supabase configuration (async client, created on first use or by the warmup below)
+store = SupabaseStore()
+
+# Every submission is saved locally first, the reconciler pushes whatever hasn't reached Supabase yet
+with startup.phase("open local store"):
+    local_store = LocalStore()
+reconciler = Reconciler(local_store, store, shared_state)
+
+# Recently handled submissions, so resubmits and double clicks get the original result back
+recent_submissions = SharedRecentSubmissions(shared_state) if SHARED else RecentSubmissions()
 
 #ionos smtp password
 password = os.environ.get('EMAIL_PASSWORD')
 
+# Confirmation emails are queued here and sent by a background worker over one reused SMTP session
+outbox = SharedOutbox(SMTPConnection(password=password), shared_state) if SHARED else Outbox(SMTPConnection(password=password))
 
-today = datetime.now().strftime("%m/%d/%Y, %H:%M:%S")
+# In digest mode the committee gets periodic summaries instead of a copy of every confirmation
+committee_digest = CommitteeDigest(local_store, outbox) if DIGEST_MINUTES else None
+
+# Clients are created lazily; once the server is listening they are opened in the background
+warm_up = startup.warm_up(
+    ("supabase client", lambda: store.warm()),
+    *([("smtp session", lambda: asyncio.to_thread(outbox.connection.warm))] if password else []),
+)
+
+# Icons and web manifest, content-hashed and precompressed once, served from memory
+with startup.phase("load static assets"):
+    static_assets = StaticAssets()
 
 # Initialize the FastHTML app
 app, rt = fast_app(
@@ -26,187 +57,118 @@ app, rt = fast_app(
             border: 2px solid red;
         }
     """),
-    Link(rel="icon", type="image/x-icon", href="assets/favicon.ico"), # Updated path
-    Link(rel="icon", type="image/png", sizes="32x32", href="assets/favicon-32x32.png"),
-    Link(rel="icon", type="image/png", sizes="16x16", href="assets/favicon-16x16.png"),
-    Link(rel="apple-touch-icon", sizes="180x180", href="assets/apple-touch-icon.png"),
-    Link(rel="icon", sizes="192x192", href="assets/android-chrome-192x192.png"),
-    Link(rel="icon", sizes="512x512", href="assets/android-chrome-512x512.png")
-    )
+    *static_assets.links()
+    ),
+    middleware=[Middleware(StaticAssetsMiddleware, assets=static_assets), Middleware(MetricsMiddleware, routes=("/", "/submit")), Middleware(AdmissionMiddleware, path="/submit")],
+    on_startup=[outbox.start, reconciler.start, warm_up] + ([committee_digest.start] if committee_digest else []),
+    on_shutdown=[outbox.stop, reconciler.stop] + ([committee_digest.stop] if committee_digest else [])
 )
 
-# Email sending function
-def send_email(data: dict):
-    msg = MIMEMultipart()
-    msg['From'] = 'admin@samcresearchforum.org'
-    msg['To'] = data['email']
-    msg['Subject'] = 'Scholarly Activity Submission'
-    body = f"Dear {data['full_name'].title()}, \nYour submission for {data['research_type']} with the following description:\n\nSubmit Date: {today}\nDepartment: {data['dept']}\nDescription: {data['description']}\nSubmit to Research Forum: {data['post_forum'] == 'on'}\n\nThank you for your submission. Please let us know if you have any questions. \nSincerely,\nSAMC Research Committee"
-    msg.attach(MIMEText(body, 'plain'))
-
-    # Prepare email recipients
-    recipients = [data['email']]+['phillip.kim@samc.com']
-
-    # Send the email
-    server = smtplib.SMTP('smtp.ionos.com', 587)
-    server.starttls()
-    server.login('admin@samcresearchforum.org', password)
-    text = msg.as_string()
-    server.sendmail('admin@samcresearchforum.org', recipients, text)
-    server.quit()
-
-@dataclass
-class FormSubmission:
-    id: int  # auto incremented
-    #date: str
-    full_name: str
-    title: str
-    dept: str
-    research_type: str
-    email: str
-    description: str
-    post_forum: bool = False  # Default to False since it's optional
-
-# Define a helper function to validate email
-def is_valid_email(email):
-    # Simple email validation (can be enhanced with more robust regex)
-    return re.match(r"[^@]+@[^@]+\.[^@]+", email)
-
-#create a required label asterik
-def required_label(text):
-    return Label(
-        text, 
-        Span("*", style="color: red;")
-    )
+# Pages that never change between requests are rendered once and served from here
+page_cache = RenderCache(app, shared_state)
 
+# Email sending function
+async def send_email(data: dict):
+    # Prepare email recipients (the committee is cc'd unless it gets digests)
+    recipients = [data['email']] + ([] if committee_digest else [emails.COMMITTEE_EMAIL])
+
+    # Queue the email, the outbox worker sends it after the response has gone out
+    await outbox.put(emails.SENDER, recipients, emails.confirmation(data))
+
+# Save a submission locally, then try Supabase; returns the row to show the user
+async def save_submission(submission: dict, idempotency_key=None):
+    with stage("local_store"):
+        saved = await asyncio.to_thread(local_store.add, submission, idempotency_key)
+    submitted_data = {**saved, "id": "Pending"}
+    if WRITE_BEHIND:
+        # Left for the reconciler, which inserts in bulk
+        reconciler.notify()
+        return submitted_data
+    try:
+        with stage("supabase"):
+            response = await asyncio.wait_for(store.upsert_many([to_remote(saved)]), REMOTE_TIMEOUT)
+    except Exception as e:
+        # Supabase is slow or down, the reconciler will retry with the same idempotency key
+        if not isinstance(e, SchemaError):  # a missing migration is reported once by the store
+            print("Supabase insert failed, kept locally:", repr(e))
+        metrics.supabase_errors.inc("submit")
+        reconciler.notify()
+        return submitted_data
+    if response.data:
+        await asyncio.to_thread(local_store.mark_synced, [(saved["idempotency_key"], response.data[0]["id"])])
+        submitted_data = response.data[0]
+    return submitted_data
+
+# Build the form page (rendered once into the page cache, not per request)
+def form_page():
+    return Titled("SAMC Scholarly Activity Submission Form", render_form())
+
+page_cache.register("/", form_page)
+with startup.phase("render form page"):
+    page_cache.warm()
 
 # Define the form page
 @rt("/")
-def form_view():
-    return Titled("SAMC Scholarly Activity Submission Form", 
-        Form(method="post", action="/submit")(
-            Fieldset(
-                Label(required_label("Full Name"), Input(type="text", name="full_name", required=True, placeholder="Enter your full name")),
-                Label(required_label("Select Your Title"), 
-                      Select(name="title", required=True)(
-                          Option(value="", disabled=True, selected=True)("Select Your Title"),
-                          Option(value="Faculty")("Faculty"),
-                          Option(value="Resident")("Resident"),
-                          Option(value="Student")("Student"),
-                          Option(value="Staff")("Staff"),
-                          Option(value="Other")("Other"),
-                      )),
-                Label(required_label("Department"), 
-                       Select(name="dept", required=True)(
-                            Option(value="", disabled=True, selected=True)("Select Your Department"),
-                            Option(value="Emergency Medicine")("Emergency Medicine"),
-                            Option(value="Family Medicine")("Family Medicine"),
-                            Option(value="Internal Medicine")("Internal Medicine"),
-                            Option(value="OB/GYN")("OB/GYN"),
-                            Option(value="Surgery")("Surgery"),
-                            Option(value="Other")("Other"),
-                        )),
-                Label(required_label("Research Type"),
-                    Select(name="research_type", required=True)(
-                        Option(value="", disabled=True, selected=True)("Select Research Type"),
-                        Option(value="Abstract for Conferences")("Abstract for Conferences"),
-                        Option(value="Case Reports")("Case Reports"),
-                        Option(value="Prosepective Studies")("Prosepective Studies"),
-                        Option(value="Retrospective Studies")("Retrospective Studies"),
-                        Option(value="QI/PI")("QI/PI"),
-                        Option(value="Other")("Other"),
-                    )),
-                Label(required_label("Email"), Input(type="email", name="email", required=True, placeholder="Enter your email")),
-                Label("Project Title", Input(type="text", name="title_proj", required=False, placeholder="Optional Working Research Project Title")),
-                Label(required_label("Description"), Textarea(name="description", required=True, placeholder="Provide a brief description")),
-                Label(Input(type="checkbox", name="post_forum"), "Post to SAMC Research Forum"),  # Optional checkbox
-                   
-                # Add the required notice at the bottom of the form
-                P("* Required", style="color: red; font-style: italic;")
-            ),
-            Button(type="submit")("Submit")
-        )
-    )
+def form_view(req):
+    with stage("render"):
+        return page_cache.response(req, "/")
 
 # Handle form submission
 @rt("/submit")
 async def post(req):
-    form_data = await req.form()  # Await the form data
-
-    # Check for missing required fields
-    missing_fields = [key for key in ["full_name", "title", "email", "description"] if not form_data.get(key)]
-
-    # Email validation
-    email = form_data.get("email")
-    if email and not is_valid_email(email):
-        missing_fields.append("email")  # Add email to missing fields if invalid
-
-    if missing_fields:
-        # Re-render the form with previous data, highlighting missing fields in red
-        return Titled("Submit Form - Error", 
-            P("Please fill out all required fields or correct errors."),
-            Form(method="post", action="/submit")(
-                Fieldset(
-                    Label("Full Name", Input(type="text", name="full_name", value=form_data.get('full_name', ""), required=True, placeholder="Enter your full name", cls="error" if "full_name" in missing_fields else "")),
-                    Label("Select Your Title", 
-                          Select(name="title", required=True, cls="error" if "title" in missing_fields else "")(
-                              Option(value="")("Select Your Title"),
-                              Option(value="Faculty", selected=form_data.get('title') == "Faculty")("Faculty"),
-                              Option(value="Resident", selected=form_data.get('title') == "Resident")("Resident"),
-                              Option(value="Student", selected=form_data.get('title') == "Student")("Student"),
-                              Option(value="Staff", selected=form_data.get('title') == "Staff")("Staff"),
-                              Option(value="Other", selected=form_data.get('title') == "Other")("Other"),
-                          )),
-                    Label("Select Your Department",
-                          Select(name="dept", required=True, cls="error" if "dept" in missing_fields else "")(
-                              Option(value="")("Select Your Department"),
-                              Option(value="Emergency Medicine", selected=form_data.get('dept') == "Emergency Medicine")("Emergency Medicine"),
-                              Option(value="Family Medicine", selected=form_data.get('dept') == "Family Medicine")("Family Medicine"),
-                              Option(value="Internal Medicine", selected=form_data.get('dept') == "Internal Medicine")("Internal Medicine"),
-                              Option(value="OB/GYN", selected=form_data.get('dept') == "OB/GYN")("OB/GYN"),
-                              Option(value="Surgery", selected=form_data.get('dept') == "Surgery")("Surgery"),
-                              Option(value="Other", selected=form_data.get('dept') == "Other")("Other"),
-                          )),
-                    Label("Research Type",
-                          Select(name="research_type", required=True, cls="error" if "research_type" in missing_fields else "")(
-                              Option(value="")("Select Research Type"),
-                              Option(value="Abstract for Conferences", selected=form_data.get('research_type') == "Abstract for Conferences")("Abstract for Conferences"),
-                              Option(value="Case Reports", selected=form_data.get('research_type') == "Case Reports")("Case Reports"),
-                              Option(value="Prosepective Studies", selected=form_data.get('research_type') == "Prosepective Studies")("Prosepective Studies"),
-                              Option(value="Retrospective Studies", selected=form_data.get('research_type') == "Retrospective Studies")("Retrospective Studies"),
-                              Option(value="QI/PI", selected=form_data.get('research_type') == "QI/PI")("QI/PI"),
-                              Option(value="Other", selected=form_data.get('research_type') == "Other")("Other"),
-                          )),
-                    Label("Email", Input(type="email", name="email", value=form_data.get('email', ""), required=True, placeholder="Enter your email", cls="error" if "email" in missing_fields else "")),
-                    Label("Description", Textarea(name="description", required=True, placeholder="Provide a brief description", cls="error" if "description" in missing_fields else "")(form_data.get('description', ""))),
-                    Label(Input(type="checkbox", name="post_forum", checked="post_forum" in form_data), "Post to SAMC Research Forum")  # Optional checkbox
-                ),
-                Button(type="submit")("Submit")
+    with stage("parse"):
+        form_data = await req.form()  # Await the form data
+
+    # Check for missing required fields and invalid values (email format, select options)
+    with stage("validate"):
+        invalid_fields = validate(form_data)
+
+    if invalid_fields:
+        # A form that doesn't validate didn't submit anything, so it doesn't count against the IP limit
+        await ip_limits.release(client_ip(req.scope))
+        for field in invalid_fields:
+            metrics.validation_failures.inc(field)
+        with stage("render"):
+            # From the HTMX form only the status message and the invalid fields are swapped in
+            if "hx-request" in req.headers:
+                return Response(render_errors(form_data, invalid_fields), media_type="text/html", headers={"HX-Reswap": "none"})
+            # Re-render the form with previous data, highlighting invalid fields in red
+            return Titled("Submit Form - Error",
+                P("Please fill out all required fields or correct errors."),
+                render_form(form_data, invalid_fields)
             )
-        )
     else:
-        # Save form data to Supabase
-        submission = {
-            "full_name": form_data["full_name"],
-            "title": form_data["title"],
-            "dept": form_data["dept"],
-            "research_type": form_data["research_type"],
-            "email": form_data["email"],
-            "description": form_data["description"],
-            "post_forum": "post_forum" in form_data  # Handle checkbox being optional
-        }
-        
-       # Insert data into Supabase
-        response = supabase.table("researchform").insert(submission).execute()
+        # Save form data (locally, then to Supabase) and send the email, once per identical content
+        submission = serialize(form_data)
+        token = valid_token(form_data.get(TOKEN_FIELD))
+        accepted = False
+
+        async def accept():
+            nonlocal accepted
+            # Only a new submission spends the email's rate-limit token, resubmits and retries don't
+            await check_email(submission["email"])
+            accepted = True
+            submitted_data = await save_submission(submission, token)
+            metrics.submissions.inc(submission["dept"], submission["research_type"])
+            with stage("email"):
+                await send_email(submitted_data)  # what was actually stored
+            return submitted_data
+
+        # Keyed on the content only: a token sent again with edited content (Back, edit, resubmit) is a
+        # new submission, and save_submission gives it a key of its own when the token is already stored
+        try:
+            submitted_data = await recent_submissions.run_once([content_key(submission)], accept)
+        except RateLimited as e:
+            return too_many(e.retry_after, e.reason, "hx-request" in req.headers)
+        except sqlite3.Error as e:
+            submitted_data, error_message = None, str(e)
+        if not accepted:
+            # A repeat of a recent submission, answered from the dedupe index
+            await ip_limits.release(client_ip(req.scope))
 
         # Handle response
-        if response.data:
-            # Extract the submitted data
-            submitted_data = response.data[0]  # Since it's a list with one item, we access the first element
-
+        if submitted_data:
             # Form submission successful
-            send_email({"full_name": form_data["full_name"], "title": form_data["title"], "dept": form_data["dept"], "research_type": form_data["research_type"], "email": form_data["email"], "description": form_data["description"], "post_forum": "post_forum" in form_data})   
-             # Send email to the user and static email address
             return Titled("Form Submitted", 
                 P("Your form has been successfully submitted!"),
                 Ul(*[
@@ -224,11 +186,30 @@ async def post(req):
                 A(href="/")("Submit another form")
             )
         else:
-            #print("Error inserting data:", response.error_message)
             return Titled("Error", 
                 P("An error occurred while submitting the form. Please try again later."),
-                P(f"Error Details: {response.error_message}")
+                P(f"Error Details: {error_message}")
             )
 
-# Run the server
-serve()
+# Inline validation of one field, called by the form on blur/change
+@rt("/validate/{name}")
+async def post(req, name: str):
+    form_data = await req.form()
+    try:
+        message = validate_field(name, form_data.get(name))
+    except KeyError:
+        return Response("404 Not Found", status_code=404)
+    return Response(render_field(name, form_data, {name: message} if message else None), media_type="text/html")
+
+# Prometheus metrics
+@rt("/metrics")
+def get():
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# Admin dashboard over the local store
+add_admin_routes(app, local_store)
+
+startup.ready()
+
+# Run the server (WEB_CONCURRENCY=4 python main.py starts four workers sharing state, without auto-reload)
+serve(reload=not SHARED)
@@ -0,0 +1,141 @@
+import contextvars
+import os  # get environment variables
+import threading
+import time
+from contextlib import contextmanager
+
+# In-process counters and histograms, exposed in Prometheus text format on /metrics
+
+# Requests slower than this (ms) are logged with their per-stage breakdown, 0 turns the log off
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", "0"))
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, tuple(labels), tuple(buckets)
+        self.values = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, *label_values):
+        with self._lock:
+            series = self.values.get(label_values)
+            if series is None:
+                series = self.values[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, series in sorted(self.values.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), label_values + (bound,))} {count}")
+                lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), label_values + ('+Inf',))} {series[-1]}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, label_values)} {series[-2]}")
+                lines.append(f"{self.name}_count{_labels(self.labels, label_values)} {series[-1]}")
+        return lines
+
+
+request_seconds = Histogram("researchform_request_seconds", "Time spent handling a request", ("route",))
+stage_seconds = Histogram("researchform_stage_seconds", "Time spent in each stage of a request", ("route", "stage"))
+smtp_send_seconds = Histogram("researchform_smtp_send_seconds", "Time to hand one email to the SMTP server")
+submissions = Counter("researchform_submissions_total", "Accepted submissions", ("dept", "research_type"))
+validation_failures = Counter("researchform_validation_failures_total", "Rejected submissions per invalid field", ("field",))
+smtp_errors = Counter("researchform_smtp_errors_total", "Failed SMTP sends (retry: will be retried, dead: given up)", ("kind",))
+supabase_errors = Counter("researchform_supabase_errors_total", "Failed Supabase writes", ("source",))
+rejected = Counter("researchform_rejected_total", "Submissions turned away with a 429 (ip, email or overload)", ("reason",))
+
+REGISTRY = (request_seconds, stage_seconds, smtp_send_seconds, submissions, validation_failures, smtp_errors, supabase_errors, rejected)
+
+
+def render():
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+# Per-request timer; stages opened anywhere under the request (threads included) are attributed to it
+class RequestTimer:
+    def __init__(self, route):
+        self.route = route
+        self.stages = {}
+        self.start = time.perf_counter()
+
+    def finish(self):
+        elapsed = time.perf_counter() - self.start
+        request_seconds.observe(elapsed, self.route)
+        if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+            breakdown = ", ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in self.stages.items())
+            print(f"Slow request {self.route}: {elapsed * 1000:.1f}ms ({breakdown})")
+
+
+_current = contextvars.ContextVar("request_timer", default=None)
+
+
+@contextmanager
+def request(route):
+    timer = RequestTimer(route)
+    token = _current.set(timer)
+    try:
+        yield timer
+    finally:
+        _current.reset(token)
+        timer.finish()
+
+
+@contextmanager
+def stage(name):
+    timer = _current.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe(elapsed, timer.route if timer else "background", name)
+        if timer:
+            timer.stages[name] = timer.stages.get(name, 0.0) + elapsed
+
+
+# ASGI middleware timing whole requests (including FastHTML's rendering) for the given routes
+class MetricsMiddleware:
+    def __init__(self, app, routes=()):
+        self.app = app
+        self.routes = frozenset(routes)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        # Unknown paths share one label so bots probing URLs can't blow up the series count
+        with request(scope["path"] if scope["path"] in self.routes else "other"):
+            await self.app(scope, receive, send)
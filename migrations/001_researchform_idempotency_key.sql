@@ -0,0 +1,5 @@
+-- Local-first saving (local_store.py) upserts into Supabase with on_conflict=idempotency_key,
+-- so a submission retried by the reconciler is only ever stored once. Run this once in the
+-- Supabase SQL editor before deploying; until then every write to Supabase fails.
+ALTER TABLE researchform ADD COLUMN IF NOT EXISTS idempotency_key text;
+CREATE UNIQUE INDEX IF NOT EXISTS researchform_idempotency_key ON researchform (idempotency_key);
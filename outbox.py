@@ -0,0 +1,300 @@
+import asyncio
+import os  # get environment variables
+import smtplib
+import threading
+import time
+from dataclasses import dataclass, field
+import metrics
+from shared_state import worker_id
+
+# SMTP configuration (override the host/port to point the worker at a local test server)
+SMTP_HOST = os.environ.get("SMTP_HOST", "smtp.ionos.com")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", "587"))
+SMTP_USER = os.environ.get("SMTP_USER", "admin@samcresearchforum.org")
+SMTP_STARTTLS = os.environ.get("SMTP_STARTTLS", "1") == "1"
+
+
+# Whether an SMTP error will not go away by retrying, so the message goes straight to the dead letters.
+# Decided by the reply code, not the exception type: smtplib raises the same refusals for 4xx replies
+# (greylisting, "451 too many messages", "454 temporary auth failure"), and those are retried.
+def is_permanent(e):
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in e.recipients.values())
+    return isinstance(e, smtplib.SMTPResponseException) and e.smtp_code >= 500
+
+
+@dataclass
+class OutboxMessage:
+    sender: str
+    recipients: list
+    text: str
+    attempts: int = 0
+    last_error: str = ""
+    queued_at: float = field(default_factory=time.time)
+    id: int = None  # row id in the shared outbox
+
+
+# A single authenticated SMTP session that is kept open and reused between messages
+class SMTPConnection:
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, user=SMTP_USER, password=None, starttls=SMTP_STARTTLS, timeout=30):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.server = None
+        self.lock = threading.Lock()  # the outbox worker and the startup warmup run in different threads
+
+    def connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            server.starttls()
+        if self.password:
+            server.login(self.user, self.password)
+        self.server = server
+
+    def is_alive(self):
+        if self.server is None:
+            return False
+        try:
+            return self.server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    # Open the session ahead of the first email (it is closed again if nothing is sent for a while)
+    def warm(self):
+        with self.lock:
+            if self.server is None:
+                self.connect()
+
+    def send(self, message: OutboxMessage):
+        with self.lock:
+            # Reconnect only when the previous session has been dropped by the server
+            if not self.is_alive():
+                self._close()
+                self.connect()
+            # Recipients refused while others were accepted: {address: (code, reply)}
+            return self.server.sendmail(message.sender, message.recipients, message.text)
+
+    def close(self):
+        with self.lock:
+            self._close()
+
+    def _close(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self.server = None
+
+
+# Queue of outgoing emails drained by a background worker so requests never wait on SMTP
+class Outbox:
+    def __init__(self, connection: SMTPConnection, batch_size=20, max_attempts=5, backoff=2.0, max_backoff=300.0, idle_timeout=60.0):
+        self.connection = connection
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.idle_timeout = idle_timeout
+        self.queue = asyncio.Queue()
+        self.dead_letters = []
+        self.sent = 0
+        self._retries = set()
+        self._worker = None
+
+    def enqueue(self, sender, recipients, text):
+        self.queue.put_nowait(OutboxMessage(sender=sender, recipients=list(recipients), text=text))
+
+    # What request handlers and jobs call: the shared outbox has to write to disk, this one doesn't
+    async def put(self, sender, recipients, text):
+        self.enqueue(sender, recipients, text)
+
+    async def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self, timeout=10.0):
+        # Give queued mail a chance to go out before shutting down
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        for handle in self._retries:
+            handle.cancel()
+        self._retries.clear()
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        await asyncio.to_thread(self.connection.close)
+
+    async def _run(self):
+        while True:
+            try:
+                first = await asyncio.wait_for(self.queue.get(), self.idle_timeout)
+            except asyncio.TimeoutError:
+                # Nothing to send for a while, don't hold the SMTP session open
+                await asyncio.to_thread(self.connection.close)
+                continue
+
+            # Take whatever else is already waiting so it goes over the same session
+            batch = [first]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            try:
+                failed = await asyncio.to_thread(self._send_batch, batch)
+                for message in failed:
+                    self._schedule_retry(message)
+            except Exception as e:
+                # Never let one bad batch end the worker, the rest of the queue still has to go out
+                print("Outbox batch failed:", repr(e))
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _send_batch(self, batch):
+        failed = []
+        for message in batch:
+            try:
+                start = time.perf_counter()
+                refused = self.connection.send(message)
+                metrics.smtp_send_seconds.observe(time.perf_counter() - start)
+                if refused:
+                    # Delivered to the others (e.g. the user but not the committee cc), not done yet
+                    raise smtplib.SMTPRecipientsRefused(refused)
+                self.sent += 1
+            except (smtplib.SMTPException, OSError) as e:
+                message.attempts += 1
+                message.last_error = repr(e)
+                if isinstance(e, smtplib.SMTPRecipientsRefused):
+                    # Only the refused recipients are tried again; smtplib has already reset the session
+                    message.recipients = [r for r in message.recipients if r in e.recipients]
+                else:
+                    # Connection problems or a rejected transaction: start the next message on a fresh session
+                    self.connection.close()
+                if is_permanent(e) or message.attempts >= self.max_attempts:
+                    self.dead_letters.append(message)
+                    metrics.smtp_errors.inc("dead")
+                else:
+                    failed.append(message)
+                    metrics.smtp_errors.inc("retry")
+            except Exception as e:
+                # A message smtplib can't even encode (e.g. a non-ASCII address) fails the same way every
+                # time: dead-letter it, and reset the session since it was left mid-transaction
+                message.attempts += 1
+                message.last_error = repr(e)
+                self.connection.close()
+                self.dead_letters.append(message)
+                metrics.smtp_errors.inc("dead")
+        return failed
+
+    def _retry_delay(self, message: OutboxMessage):
+        return min(self.backoff * 2 ** (message.attempts - 1), self.max_backoff)
+
+    def _schedule_retry(self, message: OutboxMessage):
+        delay = self._retry_delay(message)
+        loop = asyncio.get_running_loop()
+
+        def requeue():
+            self._retries.discard(handle)
+            self.queue.put_nowait(message)
+
+        handle = loop.call_later(delay, requeue)
+        self._retries.add(handle)
+
+
+# Multi-worker variant: messages are queued in the shared SQLite state, so one worker's mail is
+# not lost with it and every worker's sender drains the same queue. Retries are rows with a
+# later next_attempt_at instead of timers.
+class SharedOutbox(Outbox):
+    def __init__(self, connection: SMTPConnection, shared, poll_interval=5.0, **kwargs):
+        super().__init__(connection, **kwargs)
+        self.shared = shared
+        self.poll_interval = poll_interval  # picks up mail queued by the other workers
+        self.worker_id = worker_id()
+        self._wake = asyncio.Event()
+        self._stopping = False
+
+    def enqueue(self, sender, recipients, text):
+        self.shared.outbox_add(sender, list(recipients), text)
+        self._wake.set()
+
+    async def put(self, sender, recipients, text):
+        # The insert can wait on another worker's write lock, keep it off the event loop
+        await asyncio.to_thread(self.shared.outbox_add, sender, list(recipients), text)
+        self._wake.set()
+
+    async def stop(self, timeout=10.0):
+        # Whatever is still queued stays in the database for the other workers or the next start
+        self._stopping = True
+        self._wake.set()
+        if self._worker is not None:
+            try:
+                await asyncio.wait_for(self._worker, timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._worker = None
+        await asyncio.to_thread(self.connection.close)
+
+    async def _run(self):
+        idle_since = time.monotonic()
+        while not self._stopping:
+            try:
+                if await self._run_once():
+                    idle_since = time.monotonic()
+                    continue
+                if self.connection.server is not None and time.monotonic() - idle_since > self.idle_timeout:
+                    # Nothing to send for a while, don't hold the SMTP session open
+                    await asyncio.to_thread(self.connection.close)
+                due = await asyncio.to_thread(self.shared.outbox_next)
+                timeout = self.poll_interval if due is None else min(due, self.poll_interval)
+            except Exception as e:
+                # e.g. the database is locked for longer than the busy timeout; try again shortly
+                print("Shared outbox failed:", repr(e))
+                timeout = self.poll_interval
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    # Claim and send one batch; False when nothing was due
+    async def _run_once(self):
+        rows = await asyncio.to_thread(self.shared.outbox_claim, self.worker_id, self.batch_size)
+        if not rows:
+            return False
+        batch = [OutboxMessage(sender=r["sender"], recipients=r["recipients"], text=r["text"], attempts=r["attempts"],
+                               last_error=r["last_error"], queued_at=r["queued_at"], id=r["id"]) for r in rows]
+        dead_before = len(self.dead_letters)
+        try:
+            failed = await asyncio.to_thread(self._send_batch, batch)
+        except Exception as e:
+            # Unexpected failure outside any single message: mark the batch dead rather than leave it
+            # claimed, where it would be requeued after SENDING_TIMEOUT and take the next worker down too
+            print("Outbox batch failed:", repr(e))
+            failed = []
+            already_dead = {id(m) for m in self.dead_letters[dead_before:]}
+            for message in batch:
+                if id(message) not in already_dead:
+                    message.attempts += 1
+                    message.last_error = repr(e)
+                    self.dead_letters.append(message)
+                    metrics.smtp_errors.inc("dead")
+        dead = self.dead_letters[dead_before:]
+        done = {id(m) for m in failed + dead}
+        now = time.time()
+        await asyncio.to_thread(
+            self.shared.outbox_done,
+            [m.id for m in batch if id(m) not in done],
+            [(m.id, m.recipients, m.attempts, m.last_error, now + self._retry_delay(m)) for m in failed],
+            [(m.id, m.recipients, m.attempts, m.last_error) for m in dead],
+        )
+        return True
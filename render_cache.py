@@ -0,0 +1,75 @@
+import hashlib
+from email.utils import formatdate, parsedate_to_datetime
+from fasthtml.common import *
+from fastcore.xml import Html  # the variant that emits <!doctype html>, as FastHTML uses for full pages
+
+
+# Fully rendered pages kept as bytes, built once and served with validators for 304s.
+# With several workers each one renders the same bytes; the shared state makes sure they
+# also agree on Last-Modified, so a conditional request gets a 304 whichever worker serves it.
+class RenderCache:
+    def __init__(self, app, shared=None):
+        self.app = app
+        self.shared = shared
+        self.pages = {}
+        self.builders = {}
+
+    def register(self, key, builder):
+        # The builder returns the FT tree for the page, it is only called when (re)building
+        self.builders[key] = builder
+        self.invalidate(key)
+
+    def _render(self, ft, partial):
+        ft = ft if isinstance(ft, tuple) else (ft,)
+        if partial:
+            return to_xml(ft)
+        titles = [o for o in ft if getattr(o, 'tag', '') == 'title']
+        body = [o for o in ft if getattr(o, 'tag', '') != 'title']
+        page = Html(Head(*titles, *self.app.hdrs), Body(*body, *self.app.ftrs, **self.app.bodykw), **self.app.htmlkw)
+        return to_xml(page)
+
+    def build(self, key, partial=False):
+        body = self._render(self.builders[key](), partial).encode()
+        entry = {
+            "body": body,
+            "etag": '"' + hashlib.sha256(body).hexdigest()[:32] + '"',
+            "last_modified": formatdate(usegmt=True),
+        }
+        if self.shared is not None:
+            entry["last_modified"] = self.shared.page_version(f"{key}:{'partial' if partial else 'page'}", entry["etag"], entry["last_modified"])
+        self.pages[(key, partial)] = entry
+        return entry
+
+    def warm(self):
+        for key in self.builders:
+            self.build(key)
+            self.build(key, partial=True)
+
+    def invalidate(self, key=None):
+        # Call after changing anything the page is built from (e.g. the option lists)
+        if key is None:
+            self.pages.clear()
+        else:
+            self.pages.pop((key, False), None)
+            self.pages.pop((key, True), None)
+
+    def _not_modified(self, req, entry):
+        if_none_match = req.headers.get("if-none-match")
+        if if_none_match is not None:
+            return entry["etag"] in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+        if_modified_since = req.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return parsedate_to_datetime(if_modified_since) >= parsedate_to_datetime(entry["last_modified"])
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def response(self, req, key):
+        # HTMX requests get just the fragment, like FastHTML does for uncached routes
+        partial = "hx-request" in req.headers
+        entry = self.pages.get((key, partial)) or self.build(key, partial)
+        headers = {"ETag": entry["etag"], "Last-Modified": entry["last_modified"], "Cache-Control": "no-cache", "Vary": "HX-Request"}
+        if self._not_modified(req, entry):
+            return Response(status_code=304, headers=headers)
+        return Response(entry["body"], media_type="text/html; charset=utf-8", headers=headers)
@@ -0,0 +1,217 @@
+import json
+import os  # get environment variables
+import sqlite3
+import threading
+import time
+import uuid
+from local_store import LOCAL_DB_PATH
+
+# Multi-worker mode: with more than one server process (WEB_CONCURRENCY, as read by uvicorn and
+# gunicorn) the state that has to be seen by every worker lives in SQLite instead of in-process
+# dicts. SHARED_STATE=1 turns it on when the worker count is set some other way (gunicorn -w).
+WORKERS = int(os.environ.get("WEB_CONCURRENCY", "1"))
+SHARED = WORKERS > 1 or os.environ.get("SHARED_STATE") == "1"
+
+# How long a submission being saved by one worker blocks the same submission in the others,
+# in case that worker dies before finishing; and how long an SMTP send may stay claimed
+PENDING_TIMEOUT = 30.0
+SENDING_TIMEOUT = 300.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS page_versions (
+    key TEXT PRIMARY KEY,
+    etag TEXT NOT NULL,
+    last_modified TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS recent_submissions (
+    key TEXT PRIMARY KEY,
+    expires_at REAL NOT NULL,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS recent_submissions_expires_at ON recent_submissions (expires_at);
+CREATE TABLE IF NOT EXISTS rate_buckets (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (name, key)
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY,
+    sender TEXT NOT NULL,
+    recipients TEXT NOT NULL,
+    text TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT NOT NULL DEFAULT '',
+    queued_at REAL NOT NULL,
+    next_attempt_at REAL NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    claimed_by TEXT,
+    claimed_at REAL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_queued ON outbox (next_attempt_at) WHERE status = 'queued';
+"""
+
+GET_PAGE_SQL = "SELECT etag, last_modified FROM page_versions WHERE key = ?"
+SET_PAGE_SQL = "INSERT INTO page_versions (key, etag, last_modified) VALUES (?, ?, ?) ON CONFLICT (key) DO UPDATE SET etag = excluded.etag, last_modified = excluded.last_modified"
+
+SUBMISSION_SQL = "SELECT result FROM recent_submissions WHERE key = ? AND expires_at >= ?"
+CLAIM_SUBMISSION_SQL = "INSERT OR REPLACE INTO recent_submissions (key, expires_at, result) VALUES (?, ?, NULL)"
+FINISH_SUBMISSION_SQL = "UPDATE recent_submissions SET expires_at = ?, result = ? WHERE key = ?"
+RELEASE_SUBMISSION_SQL = "DELETE FROM recent_submissions WHERE key = ? AND result IS NULL"
+EXPIRE_SUBMISSIONS_SQL = "DELETE FROM recent_submissions WHERE expires_at < ?"
+
+GET_BUCKET_SQL = "SELECT tokens, updated_at FROM rate_buckets WHERE name = ? AND key = ?"
+SET_BUCKET_SQL = "INSERT OR REPLACE INTO rate_buckets (name, key, tokens, updated_at) VALUES (?, ?, ?, ?)"
+REFUND_BUCKET_SQL = "UPDATE rate_buckets SET tokens = MIN(?, tokens + 1) WHERE name = ? AND key = ?"
+SWEEP_BUCKETS_SQL = "DELETE FROM rate_buckets WHERE name = ? AND tokens + (? - updated_at) * ? >= ?"
+
+GET_LEASE_SQL = "SELECT holder, expires_at FROM leases WHERE name = ?"
+SET_LEASE_SQL = "INSERT OR REPLACE INTO leases (name, holder, expires_at) VALUES (?, ?, ?)"
+RELEASE_LEASE_SQL = "DELETE FROM leases WHERE name = ? AND holder = ?"
+
+OUTBOX_ADD_SQL = "INSERT INTO outbox (sender, recipients, text, queued_at, next_attempt_at) VALUES (?, ?, ?, ?, ?)"
+OUTBOX_CLAIM_SQL = """UPDATE outbox SET status = 'sending', claimed_by = ?, claimed_at = ? WHERE id IN (
+    SELECT id FROM outbox WHERE status = 'queued' AND next_attempt_at <= ? ORDER BY id LIMIT ?)"""
+OUTBOX_CLAIMED_SQL = "SELECT * FROM outbox WHERE status = 'sending' AND claimed_by = ? ORDER BY id"
+OUTBOX_RECLAIM_SQL = "UPDATE outbox SET status = 'queued', claimed_by = NULL WHERE status = 'sending' AND claimed_at < ?"
+OUTBOX_NEXT_SQL = "SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'queued'"
+OUTBOX_SENT_SQL = "DELETE FROM outbox WHERE id = ?"
+OUTBOX_RETRY_SQL = "UPDATE outbox SET status = 'queued', claimed_by = NULL, recipients = ?, attempts = ?, last_error = ?, next_attempt_at = ? WHERE id = ?"
+OUTBOX_DEAD_SQL = "UPDATE outbox SET status = 'dead', claimed_by = NULL, recipients = ?, attempts = ?, last_error = ? WHERE id = ?"
+
+
+# State shared by all worker processes, kept in the local SQLite database next to the submissions.
+# Times are wall-clock (time.time) since monotonic clocks are not comparable between processes.
+class SharedState:
+    def __init__(self, path=LOCAL_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._claims = 0
+        self.conn().executescript(SCHEMA)
+
+    def conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # Rendered pages: every worker renders the same bytes, this keeps Last-Modified identical too
+    def page_version(self, key, etag, last_modified):
+        conn = self.conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(GET_PAGE_SQL, (key,)).fetchone()
+            if row is not None and row["etag"] == etag:
+                return row["last_modified"]
+            conn.execute(SET_PAGE_SQL, (key, etag, last_modified))
+            return last_modified
+
+    # Duplicate submissions: returns None when the keys were claimed for this worker to save,
+    # otherwise (found, result) where result is None while another worker is still saving it
+    def claim_submission(self, keys):
+        now = time.time()
+        conn = self.conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for key in keys:
+                row = conn.execute(SUBMISSION_SQL, (key, now)).fetchone()
+                if row is not None:
+                    return True, row["result"] and json.loads(row["result"])
+            conn.executemany(CLAIM_SUBMISSION_SQL, [(key, now + PENDING_TIMEOUT) for key in keys])
+            self._claims += 1
+            if self._claims % 256 == 0:
+                conn.execute(EXPIRE_SUBMISSIONS_SQL, (now,))
+        return None
+
+    def finish_submission(self, keys, result, ttl):
+        conn = self.conn()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(FINISH_SUBMISSION_SQL, [(time.time() + ttl, json.dumps(result), key) for key in keys])
+
+    def release_submission(self, keys):
+        conn = self.conn()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(RELEASE_SUBMISSION_SQL, [(key,) for key in keys])
+
+    # Token buckets for admission control, see admission.TokenBuckets
+    def take_token(self, name, key, rate, capacity, now):
+        conn = self.conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(GET_BUCKET_SQL, (name, key)).fetchone()
+            tokens, updated = (row["tokens"], row["updated_at"]) if row else (capacity, now)
+            tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+            allowed = tokens >= 1
+            conn.execute(SET_BUCKET_SQL, (name, key, tokens - 1 if allowed else tokens, now))
+        return 0.0 if allowed else (1 - tokens) / rate
+
+    def refund_token(self, name, key, capacity):
+        self.conn().execute(REFUND_BUCKET_SQL, (capacity, name, key))
+
+    def sweep_tokens(self, name, rate, capacity, now):
+        self.conn().execute(SWEEP_BUCKETS_SQL, (name, now, rate, capacity))
+
+    # Leases for jobs only one worker should run at a time; a holder that stops renewing loses it after ttl
+    def hold_lease(self, name, holder, ttl):
+        now = time.time()
+        conn = self.conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(GET_LEASE_SQL, (name,)).fetchone()
+            if row is not None and row["holder"] != holder and row["expires_at"] >= now:
+                return False
+            conn.execute(SET_LEASE_SQL, (name, holder, now + ttl))
+        return True
+
+    def release_lease(self, name, holder):
+        self.conn().execute(RELEASE_LEASE_SQL, (name, holder))
+
+    # Email outbox: any worker can queue a message, whichever worker claims it sends it
+    def outbox_add(self, sender, recipients, text):
+        now = time.time()
+        self.conn().execute(OUTBOX_ADD_SQL, (sender, json.dumps(recipients), text, now, now))
+
+    def outbox_claim(self, worker_id, limit):
+        now = time.time()
+        conn = self.conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # Messages claimed by a worker that died mid-send go back in the queue
+            conn.execute(OUTBOX_RECLAIM_SQL, (now - SENDING_TIMEOUT,))
+            conn.execute(OUTBOX_CLAIM_SQL, (worker_id, now, now, limit))
+            rows = conn.execute(OUTBOX_CLAIMED_SQL, (worker_id,)).fetchall()
+        return [dict(row, recipients=json.loads(row["recipients"])) for row in rows]
+
+    # Seconds until the next queued message is due, None when the queue is empty
+    def outbox_next(self):
+        next_attempt_at = self.conn().execute(OUTBOX_NEXT_SQL).fetchone()[0]
+        return None if next_attempt_at is None else max(0.0, next_attempt_at - time.time())
+
+    def outbox_done(self, sent, retry, dead):
+        # sent: ids; retry: (id, recipients, attempts, last_error, next_attempt_at); dead: (id, recipients, attempts, last_error)
+        # recipients are the ones still outstanding, a partly delivered message keeps only those
+        conn = self.conn()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(OUTBOX_SENT_SQL, [(id,) for id in sent])
+            conn.executemany(OUTBOX_RETRY_SQL, [(json.dumps(rcpt), attempts, error, at, id) for id, rcpt, attempts, error, at in retry])
+            conn.executemany(OUTBOX_DEAD_SQL, [(json.dumps(rcpt), attempts, error, id) for id, rcpt, attempts, error in dead])
+
+
+def worker_id():
+    return f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+shared_state = SharedState() if SHARED else None
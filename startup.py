@@ -0,0 +1,102 @@
+import asyncio
+import os  # get environment variables
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+# Startup timing: STARTUP_PROFILE=1 prints where import and init time went once the app is up.
+#   python startup.py            full report, including the slowest imports (python -X importtime)
+STARTUP_PROFILE = os.environ.get("STARTUP_PROFILE") == "1"
+# Open the Supabase client and SMTP session in the background once the server is up (0 = on first use)
+STARTUP_WARM = os.environ.get("STARTUP_WARM", "1") == "1"
+
+started_at = ready_at = time.perf_counter()
+phases = []  # (name, seconds, background)
+
+
+@contextmanager
+def phase(name, background=False):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases.append((name, time.perf_counter() - start, background))
+
+
+def report(file=sys.stderr):
+    print("Startup profile", file=file)
+    for name, seconds, background in phases:
+        if not background:
+            print(f"  {name:<32} {seconds * 1000:>8.1f} ms", file=file)
+    print(f"  {'ready to serve after':<32} {(ready_at - started_at) * 1000:>8.1f} ms", file=file)
+    for name, seconds, background in phases:
+        if background:
+            print(f"  {name:<32} {seconds * 1000:>8.1f} ms  (background)", file=file)
+
+
+# Called once the module-level setup is done: everything measured so far sat in front of the first request
+def ready():
+    global ready_at
+    ready_at = time.perf_counter()
+    if STARTUP_PROFILE:
+        report()
+
+
+# on_startup hook that runs the warmup jobs after startup has finished, without holding it up
+def warm_up(*jobs):
+    tasks = set()
+
+    async def run():
+        await asyncio.sleep(0.1)  # let the server start accepting connections first
+        for name, job in jobs:
+            try:
+                with phase(name, background=True):
+                    await job()
+            except Exception as e:
+                # Nothing lost, the same thing is done again on first use
+                print(f"Warmup of {name} failed:", repr(e))
+        if STARTUP_PROFILE:
+            report()
+
+    async def start():
+        if STARTUP_WARM and jobs:
+            task = asyncio.create_task(run())
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    return start
+
+
+# Slowest modules by cumulative import time, from python -X importtime
+def import_times(module="main", top=15):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, env={**os.environ, "STARTUP_PROFILE": "1", "STARTUP_WARM": "0"})
+    rows, children = [], []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        # Children are listed before their parent: keep the direct imports of the module itself
+        if depth == 1:
+            children.append((int(cumulative) / 1e6, name.strip()))
+        elif depth == 0:
+            if name.strip() == module:
+                rows = children + [(int(cumulative) / 1e6, module)]
+            children = []
+    profile = [line for line in result.stderr.splitlines() if not line.startswith("import time:")]
+    return sorted(rows, reverse=True)[:top], profile
+
+
+def main():
+    module = sys.argv[1] if len(sys.argv) > 1 else "main"
+    rows, profile = import_times(module)
+    print(f"Slowest imports under {module}")
+    for seconds, name in rows:
+        print(f"  {name:<32} {seconds * 1000:>8.1f} ms")
+    print("\n".join(profile))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os  # get environment variables
+import sys
+from fasthtml.common import Link
+
+# Icons and the web manifest, bundled with the app (the directory name is as committed)
+ASSETS_DIR = os.environ.get("ASSETS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "assests"))
+URL_PREFIX = "/assets/"
+
+# Hashed URLs never change content, so browsers may keep them for a year without asking again
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Plain names (e.g. the /favicon.ico browsers request on their own) are revalidated daily
+SHORT = "public, max-age=86400"
+
+# Already-compressed formats (png) gain nothing from gzip/brotli
+COMPRESSIBLE = {".ico", ".webmanifest", ".svg", ".txt", ".json", ".css", ".js"}
+mimetypes.add_type("application/manifest+json", ".webmanifest")
+mimetypes.add_type("image/x-icon", ".ico")
+
+# Head links: file -> attributes, in the order they appear on the page
+LINKS = (
+    ("favicon.ico", dict(rel="icon", type="image/x-icon")),
+    ("favicon-32x32.png", dict(rel="icon", type="image/png", sizes="32x32")),
+    ("favicon-16x16.png", dict(rel="icon", type="image/png", sizes="16x16")),
+    ("apple-touch-icon.png", dict(rel="apple-touch-icon", sizes="180x180")),
+    ("android-chrome-192x192.png", dict(rel="icon", sizes="192x192")),
+    ("android-chrome-512x512.png", dict(rel="icon", sizes="512x512")),
+    ("site.webmanifest", dict(rel="manifest")),
+)
+
+
+def _brotli(body):
+    try:
+        import brotli  # optional dependency, gzip only without it
+    except ImportError:
+        return None
+    return brotli.compress(body, quality=11)
+
+
+def _hashed_name(name, body):
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(body).hexdigest()[:12]}{ext}"
+
+
+# Every asset read once at startup: content-hashed name, precompressed variants, served from memory
+class StaticAssets:
+    def __init__(self, directory=ASSETS_DIR):
+        self.directory = directory
+        self.files = {}  # URL path -> asset entry
+        self.manifest = {}  # file name -> hashed URL
+        names = sorted(n for n in os.listdir(directory) if not n.startswith(".") and os.path.isfile(os.path.join(directory, n)))
+        # The web manifest points at the icons, so it is built last with their hashed URLs
+        for name in sorted(names, key=lambda n: n.endswith(".webmanifest")):
+            with open(os.path.join(directory, name), "rb") as f:
+                body = f.read()
+            if name.endswith(".webmanifest"):
+                body = self._rewrite_manifest(body)
+            self.add(name, body)
+
+    def _rewrite_manifest(self, body):
+        manifest = json.loads(body)
+        for icon in manifest.get("icons", ()):
+            icon["src"] = self.manifest.get(icon["src"].lstrip("/"), icon["src"])
+        return json.dumps(manifest, separators=(",", ":")).encode()
+
+    def add(self, name, body):
+        ext = os.path.splitext(name)[1]
+        hashed = _hashed_name(name, body)
+        entry = {
+            "identity": body,
+            "type": mimetypes.guess_type(name)[0] or "application/octet-stream",
+            "etag": '"' + hashed.split(".")[-2] + '"',
+        }
+        if ext in COMPRESSIBLE:
+            # Keep a compressed variant only when it is actually smaller
+            for encoding, compressed in (("gzip", gzip.compress(body, 9, mtime=0)), ("br", _brotli(body))):
+                if compressed is not None and len(compressed) < len(body):
+                    entry[encoding] = compressed
+        self.manifest[name] = URL_PREFIX + hashed
+        self.files[URL_PREFIX + hashed] = (entry, IMMUTABLE)
+        self.files[URL_PREFIX + name] = (entry, SHORT)
+        if name == "favicon.ico":
+            self.files["/favicon.ico"] = (entry, SHORT)
+
+    def url(self, name):
+        return self.manifest[name]
+
+    # <link> tags for the page head, pointing at the hashed URLs
+    def links(self):
+        return tuple(Link(href=self.manifest[name], **attrs) for name, attrs in LINKS if name in self.manifest)
+
+
+def _encoding(accept_encoding, entry):
+    accepted = {part.split(";")[0].strip() for part in accept_encoding.split(",")}
+    for encoding in ("br", "gzip"):
+        if encoding in entry and encoding in accepted:
+            return encoding
+    return None
+
+
+# ASGI middleware answering asset requests from memory before they reach routing
+class StaticAssetsMiddleware:
+    def __init__(self, app, assets: StaticAssets):
+        self.app = app
+        self.assets = assets
+
+    async def __call__(self, scope, receive, send):
+        found = scope["type"] == "http" and scope["method"] in ("GET", "HEAD") and self.assets.files.get(scope["path"])
+        if not found:
+            return await self.app(scope, receive, send)
+        entry, cache_control = found
+        request_headers = dict(scope["headers"])
+        headers = [
+            (b"content-type", entry["type"].encode()),
+            (b"cache-control", cache_control.encode()),
+            (b"etag", entry["etag"].encode()),
+            (b"vary", b"Accept-Encoding"),
+        ]
+        if entry["etag"].encode() in request_headers.get(b"if-none-match", b""):
+            await send({"type": "http.response.start", "status": 304, "headers": headers})
+            return await send({"type": "http.response.body", "body": b""})
+        encoding = _encoding(request_headers.get(b"accept-encoding", b"").decode("latin-1"), entry)
+        body = entry[encoding or "identity"]
+        if encoding:
+            headers.append((b"content-encoding", encoding.encode()))
+        headers.append((b"content-length", str(len(body)).encode()))
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        await send({"type": "http.response.body", "body": b"" if scope["method"] == "HEAD" else body})
+
+
+# Print the manifest: python static_assets.py
+def main():
+    assets = StaticAssets(sys.argv[1] if len(sys.argv) > 1 else ASSETS_DIR)
+    json.dump(assets.manifest, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
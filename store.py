@@ -0,0 +1,113 @@
+import asyncio
+import importlib
+import os  # get environment variables
+import time
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from supabase._async.client import AsyncClient
+
+# Supabase configuration
+SUPABASE_URL = os.environ.get("SUPABASE_URL_RC")
+SUPABASE_KEY = os.environ.get("SUPABASE_KEY_RC")
+TABLE = "researchform"
+
+# Write-behind mode: skip the inline Supabase write, the reconciler flushes submissions in bulk
+WRITE_BEHIND = os.environ.get("SUPABASE_WRITE_BEHIND") == "1"
+
+# How long /submit waits on Supabase before leaving the submission to the reconciler
+REMOTE_TIMEOUT = float(os.environ.get("SUPABASE_TIMEOUT", "3"))
+
+
+# The upserts need an idempotency_key column with a unique index in Supabase
+MIGRATION = "migrations/001_researchform_idempotency_key.sql"
+# PostgREST error codes for a missing column and for no unique constraint matching on_conflict
+SCHEMA_ERROR_CODES = ("42703", "42P10")
+# While the table is known to be missing it, writes fail fast and the schema is re-checked this often
+SCHEMA_RECHECK = 300.0
+# Errors about the rows themselves, which no retry fixes: invalid data (22xxx), constraint
+# violations (23xxx), exceptions raised by a validation trigger (P0001) and requests PostgREST
+# can't parse (PGRST1xx)
+ROW_ERROR_CODES = ("22", "23", "P0001", "PGRST1")
+
+
+class SchemaError(Exception):
+    pass
+
+
+# Supabase answered and refused the rows sent; unlike a network error, sending them again won't help
+class RowsRejected(Exception):
+    pass
+
+
+# Async Supabase access, the client (and its pooled HTTP session) is created once and reused.
+# The supabase package itself is only imported then, it takes longer to import than the rest of the app.
+class SupabaseStore:
+    def __init__(self, url=SUPABASE_URL, key=SUPABASE_KEY, client: "AsyncClient" = None):
+        self.url = url
+        self.key = key
+        self._client = client
+        self._lock = asyncio.Lock()
+        self.schema_error = None
+        self._schema_failed_at = 0.0
+
+    async def client(self) -> "AsyncClient":
+        if self._client is None:
+            async with self._lock:
+                if self._client is None:
+                    from supabase import acreate_client
+                    self._client = await acreate_client(self.url, self.key)
+        return self._client
+
+    async def warm(self):
+        # The import is done off the event loop so requests aren't held up while it runs
+        await asyncio.to_thread(importlib.import_module, "supabase")
+        await self.client()
+        await self.check_schema()
+
+    def _schema_problem(self, e):
+        if getattr(e, "code", None) not in SCHEMA_ERROR_CODES:
+            return None
+        if self.schema_error is None:
+            # Said once, loudly: nothing reaches Supabase until the migration is applied
+            print("=" * 72)
+            print(f"Supabase table '{TABLE}' cannot take idempotent upserts: {getattr(e, 'message', e)}")
+            print(f"Submissions are kept in the local store only. Apply {MIGRATION} in Supabase.")
+            print("=" * 72)
+        self.schema_error = SchemaError(f"Supabase table '{TABLE}' needs {MIGRATION}")
+        self._schema_failed_at = time.monotonic()
+        return self.schema_error
+
+    def _schema_ok(self):
+        if self.schema_error is not None:
+            print(f"Supabase table '{TABLE}' now accepts idempotent upserts, syncing resumes")
+            self.schema_error = None
+
+    # Checked when the client is warmed up, so a missing migration shows at startup rather than on the first submission
+    async def check_schema(self):
+        client = await self.client()
+        try:
+            await client.table(TABLE).select("idempotency_key").limit(1).execute()
+        except Exception as e:
+            if self._schema_problem(e) is None:
+                raise
+            return False
+        return True
+
+    async def upsert_many(self, rows: list):
+        if self.schema_error is not None and time.monotonic() - self._schema_failed_at < SCHEMA_RECHECK:
+            raise self.schema_error
+        # PostgREST turns a list body into a single multi-row INSERT ... ON CONFLICT, so rows
+        # resent with the same idempotency_key never create duplicates
+        client = await self.client()
+        try:
+            response = await client.table(TABLE).upsert(rows, on_conflict="idempotency_key").execute()
+        except Exception as e:
+            if (error := self._schema_problem(e)) is not None:
+                raise error from e
+            code = str(getattr(e, "code", None) or "")
+            if code.startswith(ROW_ERROR_CODES):
+                raise RowsRejected(f"{code}: {getattr(e, 'message', None) or e}") from e
+            raise
+        self._schema_ok()
+        return response
@@ -0,0 +1,88 @@
+import os
+import tempfile
+import unittest
+from admission import SharedTokenBuckets, TokenBuckets, client_ip
+from shared_state import SharedState
+
+# Rate-limit buckets and client address parsing
+#   python -m unittest discover tests
+
+
+def scope(client="10.0.0.1", forwarded=()):
+    return {"client": (client, 50000), "headers": [(b"x-forwarded-for", value.encode()) for value in forwarded]}
+
+
+class TokenBucketsTest(unittest.TestCase):
+    def buckets(self):
+        return TokenBuckets(rate=1.0, capacity=2)
+
+    def test_burst_then_wait(self):
+        buckets = self.buckets()
+        self.assertEqual(buckets.take("a", now=0), 0)
+        self.assertEqual(buckets.take("a", now=0), 0)
+        self.assertAlmostEqual(buckets.take("a", now=0), 1.0)
+        self.assertAlmostEqual(buckets.take("a", now=0.5), 0.5)
+        self.assertEqual(buckets.take("a", now=1.0), 0)
+        # Other keys have buckets of their own
+        self.assertEqual(buckets.take("b", now=1.0), 0)
+
+    def test_refund_gives_the_token_back(self):
+        buckets = self.buckets()
+        buckets.take("a", now=0)
+        buckets.take("a", now=0)
+        buckets.refund("a")
+        self.assertEqual(buckets.take("a", now=0), 0)
+        self.assertGreater(buckets.take("a", now=0), 0)
+
+    def test_refund_never_overfills(self):
+        buckets = self.buckets()
+        buckets.take("a", now=0)
+        buckets.refund("a")
+        buckets.refund("a")
+        buckets.refund("unknown")
+        self.assertEqual([buckets.take("a", now=0) for _ in range(2)], [0, 0])
+        self.assertGreater(buckets.take("a", now=0), 0)
+        self.assertNotIn("unknown", buckets.buckets)
+
+
+class SharedTokenBucketsTest(TokenBucketsTest):
+    def buckets(self):
+        shared = SharedState(os.path.join(tempfile.mkdtemp(), "shared.db"))
+        return SharedTokenBuckets("ip", rate=1.0, capacity=2, shared=shared)
+
+    def test_refund_never_overfills(self):
+        buckets = self.buckets()
+        buckets.take("a", now=0)
+        buckets.refund("a")
+        buckets.refund("a")
+        self.assertEqual([buckets.take("a", now=0) for _ in range(2)], [0, 0])
+        self.assertGreater(buckets.take("a", now=0), 0)
+
+
+class ClientIpTest(unittest.TestCase):
+    def test_direct_clients_ignore_the_header(self):
+        self.assertEqual(client_ip(scope(forwarded=["1.2.3.4"]), trusted_hops=0), "10.0.0.1")
+
+    def test_one_proxy_takes_the_right_most_entry(self):
+        # The client wrote 6.6.6.6 itself, the proxy appended the address it actually saw
+        self.assertEqual(client_ip(scope(forwarded=["6.6.6.6, 1.2.3.4"]), trusted_hops=1), "1.2.3.4")
+
+    def test_forged_entries_all_land_in_one_bucket(self):
+        buckets = TokenBuckets(rate=1.0, capacity=2)
+        waits = [buckets.take(client_ip(scope(forwarded=[f"6.6.6.{n}, 1.2.3.4"]), trusted_hops=1), now=0) for n in range(3)]
+        self.assertEqual(waits[:2], [0, 0])
+        self.assertGreater(waits[2], 0)
+
+    def test_hops_count_from_the_right(self):
+        forwarded = ["6.6.6.6, 1.2.3.4", "10.1.1.1"]  # repeated headers are one list, in order
+        self.assertEqual(client_ip(scope(forwarded=forwarded), trusted_hops=1), "10.1.1.1")
+        self.assertEqual(client_ip(scope(forwarded=forwarded), trusted_hops=2), "1.2.3.4")
+        # Fewer entries than proxies: the furthest one there is
+        self.assertEqual(client_ip(scope(forwarded=["1.2.3.4"]), trusted_hops=2), "1.2.3.4")
+
+    def test_missing_header_falls_back_to_the_peer(self):
+        self.assertEqual(client_ip(scope(), trusted_hops=1), "10.0.0.1")
+
+
+if __name__ == "__main__":
+    unittest.main()
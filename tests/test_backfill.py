@@ -0,0 +1,115 @@
+import asyncio
+import io
+import json
+import os
+import tempfile
+import unittest
+from backfill import Checkpoint, LocalTarget, backfill
+from local_store import LocalStore
+
+# Backfill against the local stand-in store
+#   python -m unittest discover tests
+
+
+def raw(n, email=None):
+    return {
+        "full_name": f"User {n}", "title": "Faculty", "dept": "Surgery", "research_type": "Case Reports",
+        "email": email or f"user{n}@example.org", "description": f"Project {n}", "post_forum": "on",
+        "date": "09/01/2024, 10:00:00",
+    }
+
+
+def rows(count, after=0, invalid=()):
+    return [(n, raw(n, "not an email" if n in invalid else None)) for n in range(after + 1, count + 1)]
+
+
+# Fails the batches containing `fail_at` until told otherwise; optionally holds back the first batch
+class FlakyTarget(LocalTarget):
+    def __init__(self, local_store, fail_at=None, slow_first=0.0):
+        super().__init__(local_store)
+        self.fail_at = fail_at
+        self.slow_first = slow_first
+        self.calls = 0
+
+    async def upsert_many(self, batch):
+        self.calls += 1
+        if self.calls == 1 and self.slow_first:
+            await asyncio.sleep(self.slow_first)
+        if self.fail_at is not None and any(r["full_name"] == f"User {self.fail_at}" for r in batch):
+            raise ConnectionError("upstream down")
+        await super().upsert_many(batch)
+
+
+class BackfillTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.local_store = LocalStore(os.path.join(self.dir, "researchform_local.db"))
+        self.checkpoint_path = os.path.join(self.dir, "backfill.json")
+
+    def names(self):
+        return sorted(r["full_name"] for r in self.local_store.search(limit=10_000)[0])
+
+    def run_backfill(self, source, target, **kwargs):
+        checkpoint = Checkpoint(self.checkpoint_path, "test")
+        return asyncio.run(backfill(source, target, checkpoint, **kwargs)), checkpoint
+
+    def test_invalid_rows_go_to_rejects(self):
+        rejects = io.StringIO()
+        position, _ = self.run_backfill(rows(10, invalid={3, 10}), LocalTarget(self.local_store), batch_size=4, rejects=rejects)
+        self.assertEqual(position, 10)  # trailing invalid rows still move the checkpoint
+        self.assertEqual(len(self.names()), 8)
+        rejected = [json.loads(line) for line in rejects.getvalue().splitlines()]
+        self.assertEqual([r["position"] for r in rejected], [3, 10])
+        self.assertIn("email", rejected[0]["errors"])
+
+    def test_resume_after_failed_batch(self):
+        target = FlakyTarget(self.local_store, fail_at=7)
+        with self.assertRaises(ConnectionError):
+            self.run_backfill(rows(20), target, batch_size=5, parallel=1, retries=0)
+        # Rows 1-5 went in, the batch with row 7 failed: the checkpoint stops before it
+        self.assertEqual(Checkpoint(self.checkpoint_path, "test").position, 5)
+
+        target.fail_at = None
+        resumed = Checkpoint(self.checkpoint_path, "test").position
+        position, _ = self.run_backfill(rows(20, after=resumed), target, batch_size=5, parallel=1, retries=0)
+        self.assertEqual(position, 20)
+        self.assertEqual(self.names(), sorted(f"User {n}" for n in range(1, 21)))
+
+    def test_rerun_does_not_duplicate(self):
+        self.run_backfill(rows(10), LocalTarget(self.local_store), batch_size=3)
+        os.remove(self.checkpoint_path)
+        self.run_backfill(rows(10), LocalTarget(self.local_store), batch_size=3)
+        self.assertEqual(len(self.names()), 10)
+
+    def test_checkpoint_waits_for_batches_finished_out_of_order(self):
+        checkpoint = Checkpoint(None, "test")
+        checkpoint.done(1, 20)
+        checkpoint.done(2, 30)
+        self.assertEqual(checkpoint.position, 0)
+        checkpoint.done(0, 10)
+        self.assertEqual(checkpoint.position, 30)
+
+    def test_slow_first_batch_holds_the_checkpoint(self):
+        saved = []
+        target = FlakyTarget(self.local_store, slow_first=0.2)
+
+        class Recording(Checkpoint):
+            def save(self):
+                saved.append(self.position)
+
+        checkpoint = Recording(None, "test")
+        asyncio.run(backfill(rows(20), target, checkpoint, batch_size=5, parallel=4))
+        # The later batches finished first, but the checkpoint only moved once the first one was in
+        self.assertEqual(saved[:3], [0, 0, 0])
+        self.assertEqual(saved[-1], 20)
+        self.assertEqual(checkpoint.position, 20)
+
+    def test_parallel_batches_do_not_lock_each_other_out(self):
+        # No retries: every batch has to get the write lock on its first attempt
+        position, _ = self.run_backfill(rows(2000), LocalTarget(self.local_store), batch_size=50, parallel=4, retries=0)
+        self.assertEqual(position, 2000)
+        self.assertEqual(len(self.names()), 2000)
+
+
+if __name__ == "__main__":
+    unittest.main()
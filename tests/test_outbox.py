@@ -0,0 +1,144 @@
+import asyncio
+import socket
+import unittest
+from aiosmtpd.controller import Controller
+from outbox import Outbox, SMTPConnection
+
+# Outbox worker against a real local SMTP server (aiosmtpd)
+#   python -m unittest discover tests
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# Records delivered mail; refuses recipients starting with "reject", greylists those starting with
+# "grey" the first `greylist` times, and fails the first `fail_data` DATA commands
+class Handler:
+    def __init__(self):
+        self.delivered = []
+        self.fail_data = 0
+        self.greylist = 0
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("reject"):
+            return "550 No such user"
+        if address.startswith("grey") and self.greylist:
+            self.greylist -= 1
+            return "450 4.2.0 Greylisted"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.fail_data:
+            self.fail_data -= 1
+            return "451 Try again later"
+        self.delivered.append((envelope.mail_from, list(envelope.rcpt_tos)))
+        return "250 Message accepted"
+
+
+# Counts SMTP sessions, to check that a batch goes over one connection
+class CountingConnection(SMTPConnection):
+    connects = 0
+
+    def connect(self):
+        self.connects += 1
+        super().connect()
+
+
+class OutboxTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.handler = Handler()
+        self.controller = Controller(self.handler, hostname="127.0.0.1", port=free_port())
+        self.controller.start()
+        self.connection = CountingConnection(host="127.0.0.1", port=self.controller.port, starttls=False, timeout=5)
+        self.outbox = Outbox(self.connection, backoff=0.05, max_attempts=3)
+
+    async def asyncTearDown(self):
+        await self.outbox.stop(timeout=1)
+
+    def tearDown(self):
+        self.controller.stop()
+
+    async def wait_for(self, condition, timeout=5):
+        for _ in range(int(timeout / 0.02)):
+            if condition():
+                return
+            await asyncio.sleep(0.02)
+        self.fail("timed out")
+
+    async def test_batch_goes_over_one_session(self):
+        for n in range(5):
+            self.outbox.enqueue("admin@example.org", [f"user{n}@example.org"], f"Subject: {n}\n\nhello")
+        await self.outbox.start()
+        await self.wait_for(lambda: len(self.handler.delivered) == 5)
+        self.assertEqual(self.outbox.sent, 5)
+        self.assertEqual(self.connection.connects, 1)
+        self.assertEqual([rcpt for _, rcpt in self.handler.delivered], [[f"user{n}@example.org"] for n in range(5)])
+
+    async def test_transient_failure_is_retried_with_backoff(self):
+        self.handler.fail_data = 1
+        self.outbox.enqueue("admin@example.org", ["user@example.org"], "Subject: retry\n\nhello")
+        await self.outbox.start()
+        await self.wait_for(lambda: self.handler.delivered)
+        self.assertEqual(self.outbox.sent, 1)
+        self.assertEqual(self.outbox.dead_letters, [])
+
+    async def test_gives_up_after_max_attempts(self):
+        self.handler.fail_data = 10
+        self.outbox.enqueue("admin@example.org", ["user@example.org"], "Subject: down\n\nhello")
+        await self.outbox.start()
+        await self.wait_for(lambda: self.outbox.dead_letters)
+        self.assertEqual(self.outbox.dead_letters[0].attempts, 3)
+        self.assertEqual(self.handler.delivered, [])
+
+    async def test_refused_recipient_is_dead_lettered_at_once(self):
+        self.outbox.enqueue("admin@example.org", ["reject@example.org"], "Subject: refused\n\nhello")
+        await self.outbox.start()
+        await self.wait_for(lambda: self.outbox.dead_letters)
+        self.assertEqual(self.outbox.dead_letters[0].attempts, 1)
+        self.assertIn("SMTPRecipientsRefused", self.outbox.dead_letters[0].last_error)
+
+    async def test_greylisted_recipient_is_retried(self):
+        # A 4xx refusal raises the same SMTPRecipientsRefused as a 5xx one, but is only temporary
+        self.handler.greylist = 1
+        self.outbox.enqueue("admin@example.org", ["grey@example.org"], "Subject: greylisted\n\nhello")
+        await self.outbox.start()
+        await self.wait_for(lambda: self.handler.delivered)
+        self.assertEqual(self.handler.delivered, [("admin@example.org", ["grey@example.org"])])
+        self.assertEqual(self.outbox.dead_letters, [])
+
+    async def test_refused_cc_is_not_counted_as_sent(self):
+        self.outbox.enqueue("admin@example.org", ["user@example.org", "reject@example.org"], "Subject: cc\n\nhello")
+        await self.outbox.start()
+        await self.wait_for(lambda: self.outbox.dead_letters)
+        self.assertEqual(self.handler.delivered, [("admin@example.org", ["user@example.org"])])
+        self.assertEqual(self.outbox.dead_letters[0].recipients, ["reject@example.org"])
+        self.assertEqual(self.outbox.sent, 0)
+
+    async def test_greylisted_cc_is_retried_alone(self):
+        self.handler.greylist = 1
+        self.outbox.enqueue("admin@example.org", ["user@example.org", "grey@example.org"], "Subject: cc\n\nhello")
+        await self.outbox.start()
+        await self.wait_for(lambda: len(self.handler.delivered) == 2)
+        self.assertEqual([rcpt for _, rcpt in self.handler.delivered], [["user@example.org"], ["grey@example.org"]])
+        self.assertEqual(self.outbox.sent, 1)
+        self.assertEqual(self.outbox.dead_letters, [])
+
+    async def test_poison_message_does_not_stop_the_worker(self):
+        # smtplib raises UnicodeEncodeError for a non-ASCII address; the mail after it must still go out
+        self.outbox.enqueue("admin@example.org", ["josé@example.org"], "Subject: poison\n\nhello")
+        self.outbox.enqueue("admin@example.org", ["user@example.org"], "Subject: next\n\nhello")
+        await self.outbox.start()
+        await self.wait_for(lambda: self.handler.delivered)
+        self.assertEqual(len(self.outbox.dead_letters), 1)
+        self.assertIn("UnicodeEncodeError", self.outbox.dead_letters[0].last_error)
+        self.outbox.enqueue("admin@example.org", ["later@example.org"], "Subject: later\n\nhello")
+        await self.wait_for(lambda: len(self.handler.delivered) == 2)
+        self.assertEqual(self.outbox.queue.qsize(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
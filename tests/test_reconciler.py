@@ -0,0 +1,101 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from postgrest.exceptions import APIError
+from local_store import LocalStore, Reconciler
+from store import SupabaseStore
+
+# Reconciler against a stand-in for the Supabase client
+#   python -m unittest discover tests
+
+
+# Upserts into a dict; refuses rows whose description is "bad" like a check constraint would,
+# and can be switched to failing every request like a network outage
+class FakeClient:
+    def __init__(self):
+        self.rows = {}
+        self.requests = 0
+        self.down = False
+
+    def table(self, name):
+        return self
+
+    def upsert(self, rows, on_conflict):
+        self.pending = rows
+        return self
+
+    async def execute(self):
+        self.requests += 1
+        if self.down:
+            raise ConnectionError("Supabase unreachable")
+        if any(r["description"] == "bad" for r in self.pending):
+            raise APIError({"code": "23514", "message": 'new row violates check constraint "description_check"'})
+        data = []
+        for r in self.pending:
+            stored = self.rows.setdefault(r["idempotency_key"], {**r, "id": len(self.rows) + 1})
+            data.append(stored)
+        return SimpleNamespace(data=data)
+
+
+def submission(description):
+    return {"full_name": "Test User", "title": "Faculty", "dept": "Surgery", "research_type": "Case Reports",
+            "email": "user@example.org", "description": description, "post_forum": False}
+
+
+class ReconcilerTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.local = LocalStore(os.path.join(tempfile.mkdtemp(), "researchform_local.db"))
+        self.client = FakeClient()
+        self.reconciler = Reconciler(self.local, SupabaseStore(client=self.client), batch_size=10)
+
+    def add(self, *descriptions):
+        return [self.local.add(submission(d))["idempotency_key"] for d in descriptions]
+
+    async def test_batch_syncs_in_one_request(self):
+        self.add("one", "two", "three")
+        self.assertEqual(await self.reconciler.sync_once(), 3)
+        self.assertEqual(self.client.requests, 1)
+        self.assertEqual(self.local.unsynced(), [])
+
+    async def test_rejected_row_is_set_aside_and_the_queue_moves_on(self):
+        _, bad, _ = self.add("one", "bad", "three")
+        await self.reconciler.sync_once()
+        self.assertEqual(sorted(r["description"] for r in self.client.rows.values()), ["one", "three"])
+        self.assertEqual(self.local.unsynced(), [])
+        rejected = self.local.rejected()
+        self.assertEqual([r["idempotency_key"] for r in rejected], [bad])
+        self.assertIn("23514", rejected[0]["error"])
+
+        # Later submissions go up in one batch again, the rejected row is not resent
+        self.add("four")
+        requests = self.client.requests
+        self.assertEqual(await self.reconciler.sync_once(), 1)
+        self.assertEqual(self.client.requests, requests + 1)
+        self.assertEqual(self.local.unsynced(), [])
+
+    async def test_outage_during_fallback_keeps_progress(self):
+        self.add("one", "bad", "three")
+        client = self.client
+        execute = client.execute
+
+        # Down from the third request on: the batch and the first single row got through
+        async def flaky():
+            if client.requests >= 2:
+                client.down = True
+            return await execute()
+
+        client.execute = flaky
+        with self.assertRaises(ConnectionError):
+            await self.reconciler.sync_once()
+        self.assertEqual([r["description"] for r in self.local.unsynced()], ["bad", "three"])
+        self.assertEqual(self.local.rejected(), [])
+
+        client.execute, client.down = execute, False
+        await self.reconciler.sync_once()
+        self.assertEqual(self.local.unsynced(), [])
+        self.assertEqual([r["description"] for r in self.local.rejected()], ["bad"])
+
+
+if __name__ == "__main__":
+    unittest.main()
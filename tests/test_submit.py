@@ -0,0 +1,51 @@
+import os
+import tempfile
+import unittest
+
+# The app opens its local store at import, keep that out of the working directory
+os.environ.setdefault("LOCAL_DB", os.path.join(tempfile.mkdtemp(), "researchform_local.db"))
+os.environ.setdefault("STARTUP_WARM", "0")
+
+from starlette.testclient import TestClient
+import main
+from dedupe import RecentSubmissions
+from local_store import LocalStore
+
+# /submit end to end through the app, with the local store in a temporary file
+#   python -m unittest discover tests
+
+
+def form(description, token="a" * 32, email="user@example.org"):
+    return {
+        "full_name": "Test User", "title": "Faculty", "dept": "Surgery", "research_type": "Case Reports",
+        "email": email, "description": description, "submission_token": token,
+    }
+
+
+class SubmitTest(unittest.TestCase):
+    def setUp(self):
+        self.local_store = main.local_store = LocalStore(os.path.join(tempfile.mkdtemp(), "researchform_local.db"))
+        main.recent_submissions = RecentSubmissions()
+        main.WRITE_BEHIND = True  # rows stay local for the reconciler, no Supabase round trip
+        self.client = TestClient(main.app)
+
+    def descriptions(self):
+        return [row["description"] for row in self.local_store.search()[0]][::-1]
+
+    def test_resubmit_is_answered_from_the_first_submission(self):
+        first = self.client.post("/submit", data=form("first"))
+        again = self.client.post("/submit", data=form("first"))
+        self.assertIn("Description: first", first.text)
+        self.assertIn("Description: first", again.text)
+        self.assertEqual(self.descriptions(), ["first"])
+
+    def test_edited_resubmit_with_the_same_token_is_a_new_submission(self):
+        # Back, edit the description, submit again: the form still carries the first token
+        self.client.post("/submit", data=form("first", email="editor@example.org"))
+        edited = self.client.post("/submit", data=form("second, edited", email="editor@example.org"))
+        self.assertIn("Description: second, edited", edited.text)
+        self.assertEqual(self.descriptions(), ["first", "second, edited"])
+
+
+if __name__ == "__main__":
+    unittest.main()